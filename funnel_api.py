@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import hashlib
+import json
+from functools import lru_cache
+
+import pandas as pd
+import tornado.web
+
+from funnel_metriche import FASI_FUNNEL, NOMI_CONVERSIONI, calcola_metriche
+from funnel_periodi import mese_da_periodo, periodo_da_testo
+from funnel_storage import COLONNE_NUMERICHE, firma_dati, load_data, totali_funnel, totali_intervallo
+
+# API HTTP in sola lettura con le metriche del funnel, fuori dal server Streamlit.
+# GET /metriche?canale=Google Ads&mese=Gennaio 2025   (canale e mese ripetibili)
+# GET /metriche?canale=LinkedIn Ads&da=2025-01&a=2025-06
+# L'ETag viene dalla firma dei dati (snapshot e revisione): con If-None-Match e dati invariati
+# la risposta è 304 senza ricalcolare nulla; le risposte già calcolate restano in una cache LRU.
+PORTA_API = 8600
+RISPOSTE_IN_CACHE = 512
+
+
+# Funzione per interpretare un periodo "AAAA-MM" o "Gennaio 2025" (None se manca)
+def _periodo(testo):
+    if not testo:
+        return None
+    periodo = periodo_da_testo(testo)
+    if pd.isna(periodo):
+        try:
+            periodo = pd.Period(testo, freq="M")
+        except ValueError:
+            raise tornado.web.HTTPError(400, f"Periodo non valido: {testo}")
+    return periodo
+
+
+# Funzione per convertire un valore numpy (o None) in un numero JSON
+def _numero(valore):
+    return None if valore is None or pd.isna(valore) else float(valore)
+
+
+# Funzione per calcolare l'ETag della firma dei dati (solo caratteri ammessi in un ETag)
+def _etag(dati):
+    return hashlib.blake2b(json.dumps(dati).encode("utf-8"), digest_size=12).hexdigest()
+
+
+# Funzione per calcolare il corpo JSON di un filtro su una firma dei dati.
+# La firma fa parte della chiave: dopo una scrittura le vecchie risposte escono dalla cache.
+@lru_cache(maxsize=RISPOSTE_IN_CACHE)
+def _corpo(dati, canali, mesi, da, a):
+    canali_filtro = list(canali) if canali else None
+    if da is not None or a is not None:
+        totali = totali_intervallo(canali_filtro, da, a)
+    else:
+        totali = totali_funnel(canali=canali_filtro, mesi=list(mesi) if mesi else None)
+    metriche = calcola_metriche(totali)
+    tassi = metriche.pop("Tassi Conversione")
+    return json.dumps({
+        "revisione": dati[2],
+        "filtro": {
+            "canali": canali_filtro,
+            "mesi": list(mesi) if mesi else None,
+            "da": None if da is None else mese_da_periodo(da),
+            "a": None if a is None else mese_da_periodo(a),
+        },
+        "righe": int(totali["Righe"]),
+        "totali": {colonna: _numero(totali[colonna]) for colonna in COLONNE_NUMERICHE},
+        "fasi": {fase: _numero(totali[fase]) for fase in FASI_FUNNEL},
+        "metriche": {nome: _numero(valore) for nome, valore in metriche.items()},
+        "conversioni": {nome: _numero(tasso) for nome, tasso in zip(NOMI_CONVERSIONI, tassi)},
+    }, ensure_ascii=False)
+
+
+class GestoreMetriche(tornado.web.RequestHandler):
+    def get(self):
+        canali = tuple(canale for canale in self.get_query_arguments("canale") if canale != "Globale")
+        mesi = tuple(self.get_query_arguments("mese"))
+        da = _periodo(self.get_query_argument("da", None))
+        a = _periodo(self.get_query_argument("a", None))
+        if mesi and (da is not None or a is not None):
+            raise tornado.web.HTTPError(400, "Usa mese oppure da/a, non entrambi")
+
+        # L'ETag si legge prima dei dati: al peggio è più vecchio della risposta, mai più nuovo
+        dati = firma_dati()
+        self.set_header("Etag", f'"{_etag(dati)}"')
+        self.set_header("Cache-Control", "no-cache")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(_corpo(dati, canali, mesi, da, a))
+
+    def write_error(self, status_code, **kwargs):
+        errore = kwargs.get("exc_info", (None, None, None))[1]
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.finish(json.dumps({"errore": getattr(errore, "log_message", None) or self._reason}, ensure_ascii=False))
+
+
+# Funzione per creare l'applicazione tornado dell'API
+def crea_applicazione():
+    return tornado.web.Application([(r"/metriche", GestoreMetriche)])
+
+
+async def _avvia(host, porta):
+    # I dati si caricano all'avvio: la prima richiesta non paga la lettura completa
+    load_data()
+    crea_applicazione().listen(porta, address=host)
+    print(f"API metriche su http://{host}:{porta}/metriche")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP delle metriche del funnel")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=PORTA_API)
+    argomenti = parser.parse_args()
+    asyncio.run(_avvia(argomenti.host, argomenti.porta))
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+
+import tornado.web
+
+# API locale che imita le risposte delle piattaforme pubblicitarie usate da funnel_connettori:
+# stessi percorsi e stessi formati JSON, con latenza ed errori transitori configurabili.
+# Avvio: python funnel_api_simulata.py --porta 8765, poi
+#        python funnel_connettori.py --url http://localhost:8765
+
+
+# Funzione per generare metriche stabili per canale e mese (stesso mese, stessi numeri)
+def metriche_simulate(canale, mese):
+    generatore = random.Random(f"{canale}|{mese}")
+    impression = generatore.randint(20_000, 200_000)
+    click = int(impression * generatore.uniform(0.005, 0.04))
+    return {"spesa": round(click * generatore.uniform(0.4, 2.5), 2), "impression": impression, "click": click}
+
+
+class GestoreSimulato(tornado.web.RequestHandler):
+    canale = None
+
+    def initialize(self, latenza, errori):
+        self.latenza = latenza
+        self.errori = errori
+
+    async def prepare(self):
+        await asyncio.sleep(self.latenza * random.uniform(0.5, 1.0))
+        if not self.request.headers.get("Authorization") and not self.get_query_argument("access_token", None):
+            self.send_error(401)
+        elif random.random() < self.errori:
+            # Errori transitori, come i limiti di frequenza delle piattaforme reali
+            if random.random() < 0.5:
+                self.set_header("Retry-After", "0.1")
+                self.send_error(429)
+            else:
+                self.send_error(503)
+
+    # Funzione per rispondere con un oggetto JSON
+    def rispondi(self, dati):
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(dati))
+
+    # Funzione per leggere il mese (AAAA-MM) richiesto; 400 se manca
+    def mese(self, testo, espressione):
+        trovato = re.search(espressione, testo or "")
+        if not trovato:
+            raise tornado.web.HTTPError(400, "Intervallo di date mancante")
+        return f"{int(trovato.group(1)):04d}-{int(trovato.group(2)):02d}"
+
+
+class GoogleAds(GestoreSimulato):
+    def post(self, cliente):
+        query = json.loads(self.request.body or b"{}").get("query", "")
+        m = metriche_simulate("Google Ads", self.mese(query, r"BETWEEN '(\d{4})-(\d{2})"))
+        self.rispondi({"results": [{"metrics": {
+            "costMicros": str(int(m["spesa"] * 1_000_000)),
+            "impressions": str(m["impression"]),
+            "clicks": str(m["click"]),
+        }}]})
+
+
+class FacebookAds(GestoreSimulato):
+    def get(self, account):
+        intervallo = self.get_query_argument("time_range", "")
+        m = metriche_simulate("Facebook Ads", self.mese(intervallo, r'"since": ?"(\d{4})-(\d{2})'))
+        self.rispondi({"data": [{
+            "spend": f"{m['spesa']:.2f}", "impressions": str(m["impression"]), "clicks": str(m["click"]),
+        }], "paging": {}})
+
+
+class LinkedInAds(GestoreSimulato):
+    def get(self):
+        intervallo = self.get_query_argument("dateRange", "")
+        m = metriche_simulate("LinkedIn Ads", self.mese(intervallo, r"start:\(year:(\d+),month:(\d+)"))
+        self.rispondi({"elements": [{
+            "costInLocalCurrency": f"{m['spesa']:.2f}", "impressions": m["impression"], "clicks": m["click"],
+        }], "paging": {"count": 1, "start": 0}})
+
+
+class EmailMarketing(GestoreSimulato):
+    def get(self):
+        inizio = self.get_query_argument("since_send_time", "")
+        m = metriche_simulate("Email Marketing", self.mese(inizio, r"(\d{4})-(\d{2})"))
+        self.rispondi({"reports": [{
+            "opens": {"opens_total": m["impression"] // 10}, "clicks": {"clicks_total": m["click"] // 5},
+        }], "total_items": 1})
+
+
+# Funzione per creare l'applicazione tornado con latenza (secondi) e frequenza di errori (0-1)
+def crea_applicazione(latenza=0.2, errori=0.0):
+    opzioni = {"latenza": latenza, "errori": errori}
+    return tornado.web.Application([
+        (r"/v\d+/customers/([^/]+)/googleAds:search", GoogleAds, opzioni),
+        (r"/v[\d.]+/act_([^/]+)/insights", FacebookAds, opzioni),
+        (r"/rest/adAnalytics", LinkedInAds, opzioni),
+        (r"/3.0/reports", EmailMarketing, opzioni),
+    ])
+
+
+async def _avvia(porta, latenza, errori):
+    crea_applicazione(latenza, errori).listen(porta)
+    print(f"API simulata su http://localhost:{porta} (latenza fino a {latenza}s, errori {errori:.0%})")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API simulata delle piattaforme pubblicitarie")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latenza", type=float, default=0.2, help="Latenza massima di ogni risposta (secondi)")
+    parser.add_argument("--errori", type=float, default=0.0, help="Frequenza di errori 429/503 (0-1)")
+    argomenti = parser.parse_args()
+    asyncio.run(_avvia(argomenti.porta, argomenti.latenza, argomenti.errori))
@@ -1,190 +1,166 @@
+import os
+
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-import os
 
-# File CSV per salvare i dati
-DATA_FILE = "funnel_data.csv"
-
-# Funzione per caricare i dati esistenti
-def load_data():
-    if os.path.exists(DATA_FILE):
-        df = pd.read_csv(DATA_FILE)
-        # Aggiungi colonna "Note" se mancante
-        if "Note" not in df.columns:
-            df["Note"] = ""
-        # Aggiungi colonna "Valore contratti" se mancante
-        if "Valore contratti" not in df.columns:
-            df["Valore contratti"] = 0
-        return df
-    else:
-        return pd.DataFrame(columns=["Mese", "Canale", "Investimento", "Impression", "Click", "Lead", 
-                                     "Assessment Fissati", "Assessment Fatti", 
-                                     "Accordi Inviati", "Vendite", "Note", "Valore contratti"])
-
-# Funzione per salvare i dati
-def save_data(df):
-    df.to_csv(DATA_FILE, index=False)
-
-# Carica i dati esistenti
-data = load_data()
-
-# Funzione per modificare un record
-def modifica_dati(index, valori_modificati):
-    global data
-    for key, value in valori_modificati.items():
-        data.loc[index, key] = value
-    save_data(data)
-
-# Funzione per calcolare le metriche
-def calcola_metriche(dati, globale=False):
-    investimento_totale = dati["Investimento"].sum()
-    lead_totali = dati["Lead"].sum()
-    vendite_totali = dati["Vendite"].sum()
-    cpl = investimento_totale / lead_totali if lead_totali > 0 else None
-    cac = investimento_totale / vendite_totali if vendite_totali > 0 else None
-
-    click_totali = dati["Click"].sum()
-    impression_totali = dati["Impression"].sum()
-    conversione_landing = (click_totali / impression_totali) * 100 if impression_totali > 0 else None
-    cpc = investimento_totale / click_totali if click_totali > 0 else None
-
-    valore_contratti_totale = dati["Valore contratti"].sum()
-
-    metriche = {
-        "Investimento Totale": investimento_totale,
-        "CPC (Costo per Click)": cpc,
-        "CPL (Costo per Lead)": cpl,
-        "Tasso di conversione Landing": conversione_landing,
-        "CAC (Costo Cliente)": cac,
-        "Valore contratti": valore_contratti_totale,
-    }
-
-    # Calcolo dei tassi di conversione per le varie fasi
-    conversione_lead = (lead_totali / click_totali) * 100 if click_totali > 0 else None
-    conversione_assessment_fissati = (dati["Assessment Fissati"].sum() / lead_totali) * 100 if lead_totali > 0 else None
-    conversione_assessment_fatti = (dati["Assessment Fatti"].sum() / dati["Assessment Fissati"].sum()) * 100 if dati["Assessment Fissati"].sum() > 0 else None
-    conversione_accordi = (dati["Accordi Inviati"].sum() / dati["Assessment Fatti"].sum()) * 100 if dati["Assessment Fatti"].sum() > 0 else None
-    conversione_vendite = (vendite_totali / dati["Accordi Inviati"].sum()) * 100 if dati["Accordi Inviati"].sum() > 0 else None
-
-    metriche["Tassi Conversione"] = [
-        conversione_lead,
-        conversione_assessment_fissati,
-        conversione_assessment_fatti,
-        conversione_accordi,
-        conversione_vendite,
-    ]
-
-    return metriche
-
-# Funzione per visualizzare metriche in stile card
+from funnel_storage import COLONNE_NUMERICHE, load_data, totali_funnel, totali_intervallo, elenco_mesi, celle_funnel, periodi_disponibili, mesi_non_validi, record_duplicati, cerca_record, cerca_note, leggi_record, leggi_chiave, salva_record, modifica_dati, elimina_dati, revisione_dati, stesso_record, RecordDuplicato, ConflittoVersione
+from funnel_periodi import MESI, mese_da_periodo
+from funnel_metriche import calcola_metriche, tabella_metriche, FORMATI_METRICHE
+from funnel_grafici import crea_grafico_funnel, html_card_metriche
+from funnel_import import CANALI, importa
+from funnel_previsioni import MESI_MINIMI, addestramento_in_corso, aggiorna_previsioni, leggi_previsioni
+from funnel_report import FORMATI, avvia_report, elimina_report, stato_report
+from funnel_tracce import Traccia, chiudi_traccia, imposta_attributo, inizia_traccia, intervallo
+
+# Traccia della rerun: campionata (FUNNEL_TRACCE_CAMPIONE) o sempre se il pannello di debug è attivo.
+# Il pannello si abilita con ?debug=1 nell'indirizzo o con FUNNEL_DEBUG=1.
+debug_abilitato = os.environ.get("FUNNEL_DEBUG") == "1" or st.query_params.get("debug") == "1"
+inizia_traccia("rerun", forza=debug_abilitato and st.session_state.get("pannello_prestazioni", False))
+
+# Funzione per visualizzare metriche in stile card (stile e card in un solo elemento)
 def mostra_metriche_in_card(metriche):
-    st.markdown(
-        """
-        <style>
-        .card {
-            background-color: #2C2C2C;
-            color: white;
-            padding: 15px;
-            margin: 10px;
-            border-radius: 10px;
-            box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
-        }
-        .card-title {
-            font-size: 18px;
-            font-weight: bold;
-        }
-        .card-value {
-            font-size: 24px;
-            font-weight: bold;
-            color: #4CAF50;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
-
-    cols = st.columns(3)
-    i = 0
-    for key, value in metriche.items():
-        if isinstance(value, list):  # Ignora i tassi di conversione (li gestiamo separatamente)
-            continue
-        if value is None:
-            formatted_value = "N/A"
+    st.markdown(html_card_metriche(metriche), unsafe_allow_html=True)
+
+# Funzione per visualizzare tempi e contatori della rerun nella sidebar
+def mostra_pannello_prestazioni(traccia):
+    with st.sidebar.expander("Prestazioni", expanded=traccia is not None):
+        st.checkbox("Traccia le rerun di questa sessione", key="pannello_prestazioni")
+        if traccia is None:
+            st.caption("Attiva la traccia per vedere tempi e contatori della prossima rerun.")
+            return
+        st.caption(f"Rerun completa in {Traccia.millisecondi(traccia.radice):.1f} ms")
+        st.dataframe(pd.DataFrame([
+            {
+                "Fase": "· " * (intervallo_traccia["profondita"] - 1) + intervallo_traccia["nome"],
+                "ms": round(Traccia.millisecondi(intervallo_traccia), 2),
+                "Contatori": ", ".join(f"{nome} {valore}" for nome, valore in intervallo_traccia["contatori"].items()),
+            }
+            for intervallo_traccia in traccia.intervalli[1:]
+        ]), hide_index=True)
+        if traccia.contatori:
+            st.dataframe(pd.Series(traccia.contatori, name="Totale"))
+
+# Funzione per visualizzare le previsioni dei prossimi mesi: si leggono solo quelle già pronte,
+# nessun modello si addestra durante la rerun. Con un addestramento in corso gira come frammento
+# che si ricarica ogni due secondi; quando finisce, ricarica la pagina (e il frammento si ferma).
+def mostra_previsioni(canali, in_addestramento):
+    previsioni, in_attesa = leggi_previsioni(canali)
+    if in_addestramento and not addestramento_in_corso():
+        st.rerun()
+    if previsioni is None:
+        st.caption("Previsioni in preparazione..." if in_attesa else f"Servono almeno {MESI_MINIMI} mesi di dati per le previsioni.")
+        return
+    st.dataframe(previsioni, hide_index=True, column_config={
+        "Lead": st.column_config.NumberColumn("Lead", format="%.0f"),
+        "Vendite": st.column_config.NumberColumn("Vendite", format="%.0f"),
+        "Investimento": st.column_config.NumberColumn("Investimento", format="€%.2f"),
+        "CAC": st.column_config.NumberColumn("CAC", format="€%.2f"),
+    })
+    if in_attesa:
+        st.caption(f"Aggiornamento in corso per: {', '.join(in_attesa)}")
+
+# Funzione per visualizzare l'avanzamento di un lavoro di report e, a lavoro finito, lo zip da scaricare.
+# Come per le previsioni: frammento che si ricarica ogni secondo finché il lavoro è in corso.
+def mostra_avanzamento_report(lavoro, in_corso):
+    stato = stato_report(lavoro)
+    if stato is None:
+        return
+    if in_corso and stato["finito"]:
+        st.rerun()
+    if not stato["finito"]:
+        if stato["totale"] is None:
+            st.progress(0.0, text="Preparazione dei dati...")
         else:
-            # Formattazione: i valori in euro hanno il simbolo € e il tasso di conversione in %
-            if key in ["Investimento Totale", "CPC (Costo per Click)", "CPL (Costo per Lead)", "CAC (Costo Cliente)", "Valore contratti"]:
-                formatted_value = f"€{value:.2f}"
-            elif key == "Tasso di conversione Landing":
-                formatted_value = f"{value:.2f}%"
-            else:
-                formatted_value = f"{value:.2f}"
-        with cols[i % 3]:
-            st.markdown(
-                f"""
-                <div class="card">
-                    <div class="card-title">{key}</div>
-                    <div class="card-value">{formatted_value}</div>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
-        i += 1
-
-# Funzione per creare un grafico a imbuto
-def crea_grafico_funnel(dati, titolo, tassi_conversione):
-    stages = ["Lead", "Assessment Fissati", "Assessment Fatti", "Accordi Inviati", "Vendite"]
-    values = dati[["Lead", "Assessment Fissati", "Assessment Fatti", "Accordi Inviati", "Vendite"]].sum().values
-
-    fig = go.Figure()
-
-    fig.add_trace(go.Funnel(
-        y=stages,
-        x=values,
-        textposition="inside",
-        textinfo="value+percent initial",
-        marker=dict(color=["#4CAF50", "#2196F3", "#FFC107", "#FF5722", "#9C27B0"])
-    ))
-
-    # Aggiunta delle percentuali sulla destra
-    for i, percentage in enumerate(tassi_conversione):
-        fig.add_annotation(
-            x=values[i],
-            y=stages[i],
-            text=f"{percentage:.2f}%" if percentage is not None else "N/A",
-            showarrow=False,
-            xanchor="left",
-            font=dict(size=14, color="white")
-        )
-
-    fig.update_layout(
-        title=titolo,
-        font=dict(size=16),
-        plot_bgcolor="#2C2C2C",
-        paper_bgcolor="#2C2C2C",
-        font_color="white",
-        margin=dict(l=20, r=20, t=40, b=20)
-    )
-
-    return fig
+            st.progress(stato["fatti"] / max(stato["totale"], 1), text=f"{stato['fatti']} di {stato['totale']} report")
+        return
+    for errore in stato["errori"]:
+        st.error(errore)
+    if not stato["totale"]:
+        st.warning("Nessun dato nel periodo scelto.")
+        return
+    if stato["percorso"] is None:
+        return
+    st.success(f"{stato['totale'] - len(stato['errori'])} report pronti in {stato['secondi']:.1f}s")
+    try:
+        with open(stato["percorso"], "rb") as file:
+            st.download_button("Scarica lo zip", data=file.read(), file_name=stato["nome"], mime="application/zip")
+    except FileNotFoundError:
+        # Lavoro scaduto proprio adesso (vedi DURATA_LAVORI in funnel_report)
+        st.warning("Lo zip non è più disponibile: genera di nuovo i report.")
 
 # Sidebar per selezionare il canale
 st.sidebar.title("Menu Canali")
-menu_opzioni = ["Inserisci dati", "Modifica dati"] + ["Google Ads", "Facebook Ads", "LinkedIn Ads", "Email Marketing", "Altro", "Globale"]
+menu_opzioni = ["Inserisci dati", "Modifica dati"] + ["Google Ads", "Facebook Ads", "LinkedIn Ads", "Email Marketing", "Altro", "Globale", "Confronto", "Report"]
 sezione_selezionata = st.sidebar.radio("Seleziona un'opzione", options=menu_opzioni)
+imposta_attributo("pagina", sezione_selezionata)
+
+with intervallo("controlli dati"):
+    # Segnala i mesi che non rispettano il formato "Gennaio 2025" (esclusi dagli intervalli)
+    non_validi = mesi_non_validi()
+    # Segnala le coppie mese/canale inserite più volte (contate due volte nei totali)
+    duplicati = record_duplicati()
+if non_validi:
+    st.sidebar.warning(f"Mesi non riconosciuti, da correggere in \"Modifica dati\": {', '.join(non_validi)}")
+if duplicati:
+    st.sidebar.warning(f"Record duplicati, da unire in \"Modifica dati\": {', '.join(duplicati)}")
+
+# Riaddestramento in background dei soli canali i cui dati sono cambiati (non attende i processi)
+with intervallo("previsioni"):
+    aggiorna_previsioni()
 
 # Sezione per modificare i dati
 if sezione_selezionata == "Modifica dati":
     st.title("Modifica o Elimina Dati Salvati")
+    data = load_data()  # Cache condivisa dal processo, nessuna rilettura ad ogni rerun
+
+    # Messaggio dell'ultima operazione (la pagina viene ricaricata subito dopo la scrittura)
+    if "messaggio" in st.session_state:
+        st.success(st.session_state.pop("messaggio"))
     
     if data.empty:
         st.warning("Nessun dato disponibile da modificare o eliminare.")
     else:
+        # Filtri di ricerca: si formattano solo i record della pagina visibile
+        colonna_canale, colonna_testo = st.columns(2)
+        canale_filtro = colonna_canale.selectbox("Canale", ["Tutti", "Google Ads", "Facebook Ads", "LinkedIn Ads", "Email Marketing", "Altro"], key="filtro_canale")
+        testo_filtro = colonna_testo.text_input("Cerca (mese, canale o note)", key="filtro_testo")
+        canali_filtro = [canale_filtro] if canale_filtro != "Tutti" else None
+        da = a = None
+        periodi = periodi_disponibili(canali_filtro)
+        if periodi and st.checkbox("Filtra per intervallo di mesi", key="filtro_periodo"):
+            colonna_da, colonna_a = st.columns(2)
+            da = colonna_da.selectbox("Dal mese", options=periodi, format_func=mese_da_periodo, key="filtro_da")
+            a = colonna_a.selectbox("Al mese", options=periodi, index=len(periodi) - 1, format_func=mese_da_periodo, key="filtro_a")
+
+        per_pagina = 25
+        etichette, totale_record, pagina = cerca_record(
+            canali_filtro, da, a, testo_filtro,
+            pagina=st.session_state.get("filtro_pagina", 1) - 1, per_pagina=per_pagina,
+        )
+        pagine = max((totale_record - 1) // per_pagina + 1, 1)
+        st.session_state["filtro_pagina"] = pagina + 1
+        st.number_input(f"Pagina (di {pagine})", min_value=1, max_value=pagine, step=1, key="filtro_pagina")
+        st.caption(f"{totale_record} record trovati")
+
         # Seleziona il record da modificare o eliminare
-        indice_record = st.selectbox("Seleziona il record da modificare o eliminare", data.index, format_func=lambda i: f"{data.loc[i, 'Mese']} - {data.loc[i, 'Canale']}")
+        indice_record = st.selectbox("Seleziona il record da modificare o eliminare", list(etichette), format_func=etichette.get)
 
         if indice_record is not None:
-            record_selezionato = data.loc[indice_record]
+            revisione = revisione_dati()
+            record_selezionato = leggi_record(indice_record)
+            # Revisione e valori del record come li ha visti questa sessione: se nel frattempo
+            # un'altra sessione lo modifica, la scrittura viene rifiutata invece di sovrascriverla
+            base = st.session_state.get("base_record")
+            if base is None or base["indice"] != indice_record:
+                base = {"indice": indice_record, "revisione": revisione, "originale": record_selezionato.to_dict()}
+                st.session_state["base_record"] = base
+            elif not stesso_record(base["originale"], record_selezionato):
+                # Il form mostra già i valori nuovi: le modifiche fatte sui vecchi non vengono salvate
+                st.session_state["base_record"] = {
+                    "indice": indice_record, "revisione": revisione, "originale": record_selezionato.to_dict()
+                }
+                base = None
+                st.warning("Il record è stato modificato da un'altra sessione: i valori mostrati sono aggiornati.")
             
             # Mostra un form precompilato con i dati del record selezionato
             mese_modificato = st.text_input("Mese", record_selezionato["Mese"])
@@ -216,24 +192,41 @@ if sezione_selezionata == "Modifica dati":
                     "Valore contratti": valore_contratti_modificato,
                     "Note": note_modificate
                 }
-                modifica_dati(indice_record, nuovi_valori)
-                st.success("Record aggiornato con successo! Ricarica manualmente la pagina per vedere i dati aggiornati.")
+                try:
+                    if base is None:
+                        raise ConflittoVersione(None, revisione)
+                    modifica_dati(indice_record, nuovi_valori, revisione=base["revisione"], originale=base["originale"])
+                except RecordDuplicato as errore:
+                    st.error(f"{errore}: modifica quel record invece di crearne un doppione.")
+                except ConflittoVersione:
+                    st.session_state.pop("base_record", None)
+                    st.error("Il record è stato modificato da un'altra sessione: ricontrolla i valori aggiornati e riprova.")
+                else:
+                    st.session_state.pop("base_record")
+                    st.session_state["messaggio"] = "Record aggiornato con successo!"
+                    st.rerun()
 
             # Bottone per eliminare il record selezionato
             if st.button("Elimina"):
-                data = data.drop(indice_record).reset_index(drop=True)  # Rimuove il record
-                save_data(data)  # Salva il dataframe aggiornato
-                st.success("Record eliminato con successo! Ricarica manualmente la pagina per vedere i dati aggiornati.")
+                try:
+                    if base is None:
+                        raise ConflittoVersione(None, revisione)
+                    elimina_dati(indice_record, revisione=base["revisione"], originale=base["originale"])
+                except ConflittoVersione:
+                    st.session_state.pop("base_record", None)
+                    st.error("Il record è stato modificato da un'altra sessione: ricontrolla i valori aggiornati e riprova.")
+                else:
+                    st.session_state.pop("base_record")
+                    st.session_state["messaggio"] = "Record eliminato con successo!"
+                    st.rerun()
 
 # Scheda per inserimento dati
 elif sezione_selezionata == "Inserisci dati":
     st.title("Inserisci Dati")
+    data = load_data()
 
     # Form per l'inserimento dei dati
-    mesi = [
-        "Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
-        "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"
-    ]
+    mesi = MESI
     anno = st.sidebar.number_input("Anno", min_value=2020, max_value=2100, value=2025, step=1)
     mese = st.sidebar.selectbox("Seleziona il mese", options=mesi)
     mese_selezionato = f"{mese} {anno}"
@@ -251,57 +244,237 @@ elif sezione_selezionata == "Inserisci dati":
     valore_contratti = st.number_input("Valore contratti (€)", min_value=0.0, step=50.0)
     note = st.text_area("Aggiungi una nota (opzionale)")
 
+    # Un solo record per mese e canale: se esiste già si sceglie come trattarlo
+    politica = "rifiuta"
+    esistente = leggi_chiave(mese_selezionato, canale)
+    if esistente is not None:
+        st.info(f"Esiste già un record per {mese_selezionato} - {canale}.")
+        scelta = st.radio(
+            "Cosa fare con i nuovi valori?",
+            ["Somma al record esistente", "Sostituisci il record esistente"],
+        )
+        politica = "unisci" if scelta == "Somma al record esistente" else "sostituisci"
+
     if st.button("Salva"):
-        nuovo_dato = pd.DataFrame({
-            "Mese": [mese_selezionato],
-            "Canale": [canale],
-            "Investimento": [investimento],
-            "Impression": [impression],
-            "Click": [click],
-            "Lead": [lead],
-            "Assessment Fissati": [assessment_fissati],
-            "Assessment Fatti": [assessment_fatti],
-            "Accordi Inviati": [accordi_inviati],
-            "Vendite": [vendite],
-            "Valore contratti": [valore_contratti],
-            "Note": [note],
-        })
-        data = pd.concat([data, nuovo_dato], ignore_index=True)
-        save_data(data)
-        st.success("Dati salvati con successo!")
+        try:
+            esito = salva_record({
+                "Mese": mese_selezionato,
+                "Canale": canale,
+                "Investimento": investimento,
+                "Impression": impression,
+                "Click": click,
+                "Lead": lead,
+                "Assessment Fissati": assessment_fissati,
+                "Assessment Fatti": assessment_fatti,
+                "Accordi Inviati": accordi_inviati,
+                "Vendite": vendite,
+                "Valore contratti": valore_contratti,
+                "Note": note,
+            }, politica=politica)
+        except RecordDuplicato as errore:
+            # Il record è stato creato nel frattempo (es. da un'altra sessione)
+            st.error(f"{errore}: ricarica la pagina per scegliere se sommare o sostituire.")
+        else:
+            data = load_data()
+            st.success({
+                "inserito": "Dati salvati con successo!",
+                "unito": "Valori sommati al record esistente!",
+                "sostituito": "Record esistente sostituito!",
+            }[esito])
+
+    # Import massivo da export CSV o Excel delle piattaforme (letto a blocchi)
+    with st.expander("Importa da file (CSV o Excel)"):
+        file_import = st.file_uploader("Export da importare", type=["csv", "xlsx", "xlsm"])
+        canale_import = st.selectbox("Canale", ["Dalla colonna del file"] + CANALI, key="canale_import")
+        politica_import = st.radio(
+            "Se il mese esiste già per il canale",
+            ["unisci", "sostituisci", "aggiorna", "rifiuta"],
+            format_func={
+                "unisci": "Somma i valori", "sostituisci": "Sostituisci il record",
+                "aggiorna": "Aggiorna solo le colonne del file", "rifiuta": "Salta il record",
+            }.get,
+            key="politica_import",
+        )
+        if file_import is not None and st.button("Importa"):
+            avanzamento = st.empty()
+            try:
+                esito = importa(
+                    file_import, nome=file_import.name,
+                    canale=None if canale_import == "Dalla colonna del file" else canale_import,
+                    politica=politica_import,
+                    avanzamento=lambda righe: avanzamento.caption(f"{righe} righe lette..."),
+                )
+            except (ValueError, UnicodeDecodeError) as errore:
+                st.error(f"Import non riuscito: {errore}")
+            else:
+                data = load_data()
+                avanzamento.empty()
+                st.success(
+                    f"Importate {esito['righe_valide']} righe su {esito['righe_lette']} in {esito['record']} record "
+                    f"mese/canale ({esito['esiti']['inserito']} nuovi, {esito['esiti']['unito']} sommati, "
+                    f"{esito['esiti']['sostituito']} sostituiti, {esito['esiti']['aggiornato']} aggiornati, "
+                    f"{esito['esiti']['saltato']} saltati)."
+                )
+                if esito["colonne_ignorate"]:
+                    st.caption(f"Colonne ignorate: {', '.join(esito['colonne_ignorate'])}")
+                if esito["righe_scartate"]:
+                    st.warning(f"{esito['righe_scartate']} righe scartate.")
+                    st.dataframe(pd.DataFrame(esito["errori"], columns=["Riga", "Motivo"]), hide_index=True)
 
     # Visualizzazione dei dati salvati
     st.subheader("Dati Salvati")
     st.dataframe(data)
 
+# Scheda per confrontare le metriche di tutti i canali e mesi
+elif sezione_selezionata == "Confronto":
+    st.title("Confronto Canali")
+
+    celle = celle_funnel()
+    if celle.empty:
+        st.warning("Nessun dato disponibile per il confronto.")
+    else:
+        # Totali per canale sul periodo scelto (dalle celle del cubo, senza rileggere le righe)
+        mese_selezionato = st.selectbox("Seleziona mese", options=["Tutti"] + elenco_mesi())
+        if mese_selezionato != "Tutti":
+            celle_periodo = celle[celle["Mese"] == mese_selezionato]
+        else:
+            celle_periodo = celle
+        with intervallo("tabella_metriche"):
+            per_canale = celle_periodo.drop(columns="Mese").groupby("Canale", dropna=False).sum()
+            confronto = tabella_metriche(per_canale)
+
+        configurazione = {
+            nome: st.column_config.NumberColumn(nome, format="€%.2f" if formato == "€" else "%.2f%%")
+            for nome, formato in FORMATI_METRICHE.items()
+        }
+
+        # Classifica ordinabile su una metrica
+        st.subheader("Classifica")
+        colonna_ordinamento, colonna_verso = st.columns(2)
+        metrica = colonna_ordinamento.selectbox("Ordina per", options=list(confronto.columns), index=list(confronto.columns).index("CAC (Costo Cliente)"))
+        verso = colonna_verso.radio("Ordine", options=["Crescente", "Decrescente"], horizontal=True)
+        classifica = confronto.sort_values(metrica, ascending=verso == "Crescente", na_position="last")
+        classifica.insert(0, "Posizione", range(1, len(classifica) + 1))
+        st.dataframe(classifica, column_config=configurazione)
+
+        # Matrice completa canale × mese
+        st.subheader("Tutti i canali per mese")
+        with intervallo("tabella_metriche"):
+            matrice = tabella_metriche(celle.set_index(["Canale", "Mese"]))
+        with intervallo("render tabelle"):
+            st.dataframe(matrice, column_config=configurazione)
+
+# Scheda per creare i report (Word o PDF) di tutti i canali e del Globale in uno zip
+elif sezione_selezionata == "Report":
+    st.title("Report per canale")
+
+    periodi = periodi_disponibili()
+    if not periodi:
+        st.warning("Nessun dato disponibile per i report.")
+    else:
+        colonna_da, colonna_a = st.columns(2)
+        da = colonna_da.selectbox("Dal mese", options=periodi, index=max(len(periodi) - 12, 0), format_func=mese_da_periodo)
+        a = colonna_a.selectbox("Al mese", options=periodi, index=len(periodi) - 1, format_func=mese_da_periodo)
+        mensili = st.checkbox("Un report per ogni mese del periodo (altrimenti uno per canale sull'intero periodo)")
+        formato = st.radio("Formato", options=FORMATI, format_func=str.upper, horizontal=True)
+        lavoro = st.session_state.get("report_lavoro")
+        stato = stato_report(lavoro) if lavoro else None
+        # I documenti si creano in processi separati: la dashboard resta utilizzabile nel frattempo
+        if st.button("Genera report", disabled=stato is not None and not stato["finito"]):
+            if lavoro:
+                elimina_report(lavoro)
+            lavoro = st.session_state["report_lavoro"] = avvia_report(da, a, mensili, formato)
+            stato = stato_report(lavoro)
+        if stato is not None:
+            in_corso = not stato["finito"]
+            st.fragment(mostra_avanzamento_report, run_every=1 if in_corso else None)(lavoro, in_corso)
+
 # Schede per visualizzare metriche e grafici (dashboard per canali o Globale)
 else:
     st.title(f"Visualizzazione {sezione_selezionata}")
 
-    # Filtro dati per canale (se non Globale)
-    if sezione_selezionata != "Globale":
-        dati_canale = data[data["Canale"] == sezione_selezionata]
-    else:
-        dati_canale = data
-
-    mesi_disponibili = dati_canale["Mese"].unique()
-    mese_selezionato = st.selectbox("Seleziona mese", options=["Tutti"] + list(mesi_disponibili))
+    # Filtro dati per canale (se non Globale) e periodo: si leggono solo i totali aggregati
+    canali = [sezione_selezionata] if sezione_selezionata != "Globale" else None
+    modalita_periodo = st.radio(
+        "Periodo",
+        options=["Tutti", "Mese", "Trimestre in corso", "Anno in corso", "Ultimi N mesi", "Intervallo"],
+        horizontal=True,
+    )
 
-    if mese_selezionato != "Tutti":
-        dati_canale = dati_canale[dati_canale["Mese"] == mese_selezionato]
+    periodi = periodi_disponibili(canali)
+    da = a = mesi = None
+    if modalita_periodo in ("Trimestre in corso", "Anno in corso", "Ultimi N mesi") and periodi:
+        # Gli intervalli relativi partono dall'ultimo mese con dati del canale
+        a = periodi[-1]
+        st.caption(f"Mese di riferimento: {mese_da_periodo(a)}")
+        if modalita_periodo == "Trimestre in corso":
+            da = a.asfreq("Q").asfreq("M", how="start")
+        elif modalita_periodo == "Anno in corso":
+            da = a.asfreq("Y").asfreq("M", how="start")
+        else:
+            numero_mesi = st.number_input("Numero di mesi", min_value=1, max_value=120, value=3, step=1)
+            da = a - (int(numero_mesi) - 1)
+    elif modalita_periodo == "Intervallo" and periodi:
+        colonna_da, colonna_a = st.columns(2)
+        da = colonna_da.selectbox("Dal mese", options=periodi, format_func=mese_da_periodo)
+        a = colonna_a.selectbox("Al mese", options=periodi, index=len(periodi) - 1, format_func=mese_da_periodo)
+
+    # Totali aggregati per il filtro scelto
+    with intervallo("filtri"):
+        if modalita_periodo in ("Tutti", "Mese"):
+            if modalita_periodo == "Mese":
+                mese_selezionato = st.selectbox("Seleziona mese", options=elenco_mesi(canali))
+                mesi = [mese_selezionato]
+            totali = totali_funnel(canali=canali, mesi=mesi)
+        elif a is None:
+            # Nessun mese valido per questo canale: intervallo vuoto
+            totali = pd.Series(0.0, index=COLONNE_NUMERICHE + ["Righe"])
+        else:
+            # Qualsiasi intervallo costa due ricerche binarie sulle somme cumulate
+            totali = totali_intervallo(canali, da, a)
 
-    if dati_canale.empty:
+    if totali["Righe"] == 0:
         st.warning(f"Nessun dato disponibile per {sezione_selezionata}.")
     else:
-        metriche = calcola_metriche(dati_canale)
+        with intervallo("calcola_metriche"):
+            metriche = calcola_metriche(totali)
         st.subheader("Metriche")
-        mostra_metriche_in_card(metriche)
+        with intervallo("render card"):
+            mostra_metriche_in_card(metriche)
+        st.subheader("Previsioni prossimi mesi")
+        in_addestramento = addestramento_in_corso()
+        st.fragment(mostra_previsioni, run_every=2 if in_addestramento else None)(canali, in_addestramento)
         st.subheader("Grafico Funnel")
-        fig = crea_grafico_funnel(dati_canale, f"Funnel per {sezione_selezionata}", metriche["Tassi Conversione"])
-        st.plotly_chart(fig)
+        fig = crea_grafico_funnel(totali, f"Funnel per {sezione_selezionata}", metriche["Tassi Conversione"])
+        with intervallo("render grafico"):
+            st.plotly_chart(fig)
 
-        # Mostra le note
+        # Note del filtro dalla più recente, una pagina alla volta, con ricerca per parole
         st.subheader("Note")
-        for _, row in dati_canale.iterrows():
-            if pd.notna(row["Note"]) and row["Note"].strip():
-                st.markdown(f"- **{row['Mese']}**: {row['Note']}")
+        testo_note = st.text_input(
+            "Cerca nelle note", key="note_testo", on_change=lambda: st.session_state.update(note_pagina=1)
+        )
+        note_per_pagina = 20
+        voci_note, totale_note, pagina_note = cerca_note(
+            canali, mesi, da, a, testo_note,
+            pagina=st.session_state.get("note_pagina", 1) - 1, per_pagina=note_per_pagina,
+        )
+        if totale_note == 0:
+            st.caption("Nessuna nota trovata.")
+        else:
+            pagine_note = (totale_note - 1) // note_per_pagina + 1
+            st.session_state["note_pagina"] = pagina_note + 1
+            if pagine_note > 1:
+                st.number_input(f"Pagina (di {pagine_note})", min_value=1, max_value=pagine_note, step=1, key="note_pagina")
+            st.caption(f"{totale_note} note")
+            # Tutta la pagina in un solo elemento; il canale si indica solo se la vista ne ha più d'uno
+            with intervallo("render note"):
+                st.markdown("\n".join(
+                    f"- **{voce['Mese']}**{' · ' + voce['Canale'] if canali is None else ''}: {voce['Note']}"
+                    for voce in voci_note
+                ))
+
+# Chiusura della traccia (esportata se campionata) e pannello prestazioni in modalità debug
+traccia_rerun = chiudi_traccia()
+if debug_abilitato:
+    mostra_pannello_prestazioni(traccia_rerun)
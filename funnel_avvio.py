@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Avvio a caldo della dashboard: equivale a "streamlit run funnel_app.py", ma dati, cubo
+# e indici si preparano all'avvio del server invece che alla prima richiesta, plotly
+# si carica in background e i modelli di previsione iniziano subito l'addestramento.
+# Esempio: python funnel_avvio.py --porta 8501
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(CARTELLA, "funnel_app.py")
+
+
+# Funzione per caricare il dataset e costruire cubo e indici nella cache del processo
+def prepara_dati():
+    from funnel_storage import cubo_funnel, indice_chiavi, indice_note, indice_periodi, load_data
+
+    inizio = time.perf_counter()
+    df = load_data()
+    cubo_funnel()
+    indice_periodi()
+    indice_chiavi()
+    indice_note()
+    return len(df), time.perf_counter() - inizio
+
+
+# Funzione per avviare l'addestramento delle previsioni nei processi separati (senza attendere)
+def avvia_previsioni():
+    from funnel_previsioni import aggiorna_previsioni
+
+    return aggiorna_previsioni()
+
+
+# Funzione per caricare plotly in un thread separato: la prima pagina non lo aspetta
+def riscalda_in_background():
+    def riscalda():
+        from funnel_grafici import riscalda_grafici
+
+        inizio = time.perf_counter()
+        riscalda_grafici()
+        print(f"Grafici pronti in {time.perf_counter() - inizio:.2f}s", flush=True)
+
+    thread = threading.Thread(target=riscalda, name="riscaldamento-grafici", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avvia la dashboard con dati e grafici già pronti")
+    parser.add_argument("--porta", type=int, help="Porta del server (predefinita di Streamlit: 8501)")
+    parser.add_argument("--host", help="Indirizzo su cui ascoltare")
+    parser.add_argument("--senza-grafici", action="store_true", help="Non caricare plotly all'avvio")
+    parser.add_argument("--senza-previsioni", action="store_true", help="Non addestrare le previsioni all'avvio")
+    argomenti = parser.parse_args()
+
+    # I moduli importati qui sono gli stessi che userà lo script: la cache resta condivisa
+    sys.path.insert(0, CARTELLA)
+    righe, secondi = prepara_dati()
+    print(f"Dati pronti: {righe} righe in {secondi:.2f}s", flush=True)
+    if not argomenti.senza_grafici:
+        riscalda_in_background()
+    if not argomenti.senza_previsioni:
+        print(f"Previsioni in addestramento: {', '.join(avvia_previsioni()) or 'nessun canale'}", flush=True)
+
+    from streamlit.web import bootstrap
+
+    opzioni = {"server_port": argomenti.porta, "server_address": argomenti.host, "server_headless": True}
+    bootstrap.load_config_options(flag_options=opzioni)
+    bootstrap.run(SCRIPT, False, [], opzioni)
@@ -0,0 +1,254 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import funnel_grafici
+import funnel_storage
+from funnel_grafici import crea_grafico_funnel
+from funnel_metriche import calcola_metriche
+from funnel_periodi import MESI, periodo_da_testo
+from funnel_storage import (
+    COLONNE, cerca_note, cerca_record, indice_note, load_data, save_data, totali_funnel, totali_intervallo,
+)
+
+# Benchmark dei percorsi usati a ogni rerun della dashboard, su dataset sintetici.
+# Esempi:
+#   python funnel_benchmark.py --righe 1000 100000 1000000 --output benchmark.json
+#   python funnel_benchmark.py --righe 100000 --confronta benchmark.json   (risultati in benchmark.nuovo.json)
+#   python funnel_benchmark.py --genera 50000 --csv funnel_data.csv
+DIMENSIONI = [1_000, 10_000, 100_000, 1_000_000]
+RIPETIZIONI = 5
+# Un'operazione più lenta di così alla prima esecuzione non viene ripetuta
+SECONDI_MAX = 30
+# Un'operazione è una regressione se la mediana supera quella precedente di questo fattore
+SOGLIA_REGRESSIONE = 1.25
+
+# Profilo di ogni canale: costo per click, CTR e tassi delle fasi del funnel (valori medi)
+PROFILI_CANALI = {
+    "Google Ads": {"cpc": 1.8, "ctr": 0.035, "lead": 0.06},
+    "Facebook Ads": {"cpc": 0.9, "ctr": 0.012, "lead": 0.04},
+    "LinkedIn Ads": {"cpc": 5.5, "ctr": 0.006, "lead": 0.09},
+    "Email Marketing": {"cpc": 0.1, "ctr": 0.02, "lead": 0.03},
+    "Altro": {"cpc": 1.2, "ctr": 0.01, "lead": 0.05},
+}
+TASSI_FASI = [0.45, 0.75, 0.5, 0.3]
+NOTE = [
+    "Campagna stagionale", "Nuova landing page", "Test A/B sugli annunci", "Budget ridotto a metà mese",
+    "Webinar di lancio", "Retargeting attivo", "Cambio agenzia", "Offerta di fine anno",
+    "Pausa per revisione creatività", "Fiera di settore",
+]
+
+
+# Funzione per generare un dataset sintetico con la forma di funnel_data.csv.
+# Le righe si distribuiscono su "anni" anni a partire da "primo_anno" e sui cinque canali;
+# oltre le combinazioni disponibili più righe condividono lo stesso mese e canale (sotto-campagne).
+def genera_dati(righe, anni=20, primo_anno=2010, quota_note=0.1, seme=0):
+    generatore = np.random.default_rng(seme)
+    canali = list(PROFILI_CANALI)
+    combinazione = np.arange(righe) % (anni * 12 * len(canali))
+    canale = combinazione % len(canali)
+    mese = (combinazione // len(canali)) % (anni * 12)
+    etichette_mesi = np.array([f"{MESI[m % 12]} {primo_anno + m // 12}" for m in range(anni * 12)], dtype=object)
+
+    profilo = {chiave: np.array([PROFILI_CANALI[c][chiave] for c in canali])[canale] for chiave in ("cpc", "ctr", "lead")}
+    impression = generatore.integers(1_000, 200_000, righe)
+    click = generatore.binomial(impression, profilo["ctr"])
+    investimento = np.round(click * profilo["cpc"] * generatore.uniform(0.7, 1.3, righe), 2)
+    fasi = [generatore.binomial(click, profilo["lead"])]
+    for tasso in TASSI_FASI:
+        fasi.append(generatore.binomial(fasi[-1], tasso))
+    note = np.array([""] + NOTE, dtype=object)
+    scelta_note = np.where(generatore.random(righe) < quota_note, generatore.integers(1, len(note), righe), 0)
+
+    df = pd.DataFrame({
+        "Mese": etichette_mesi[mese],
+        "Canale": np.array(canali, dtype=object)[canale],
+        "Investimento": investimento,
+        "Impression": impression,
+        "Click": click,
+        "Lead": fasi[0],
+        "Assessment Fissati": fasi[1],
+        "Assessment Fatti": fasi[2],
+        "Accordi Inviati": fasi[3],
+        "Vendite": fasi[4],
+        "Note": note[scelta_note],
+        "Valore contratti": np.round(fasi[4] * generatore.uniform(2_000, 15_000, righe), 2),
+    })
+    return df[COLONNE]
+
+
+# Funzione per creare un backend in una cartella temporanea
+def _backend(nome, cartella):
+    if nome == "csv":
+        return funnel_storage.BackendCSV(os.path.join(cartella, "funnel_data.csv"), os.path.join(cartella, "funnel_data.log"))
+    if nome == "parquet":
+        return funnel_storage.BackendParquet(os.path.join(cartella, "funnel_data.parquet"))
+    if nome == "sql":
+        return funnel_storage.BackendSQL(f"sqlite:///{os.path.join(cartella, 'funnel_data.db')}")
+    raise ValueError(f"Backend sconosciuto: {nome}")
+
+
+# Funzione per misurare un'operazione: "prepara" gira prima di ogni ripetizione, fuori dal tempo
+def _misura(funzione, ripetizioni, prepara=None):
+    tempi = []
+    for _ in range(ripetizioni):
+        if prepara is not None:
+            prepara()
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+        if tempi[0] > SECONDI_MAX:
+            break
+    return {"mediana": statistics.median(tempi), "minimo": min(tempi), "ripetizioni": len(tempi)}
+
+
+# Funzione per misurare tutti i percorsi caldi su un dataset di "righe" righe
+def misura_dimensione(righe, nome_backend="csv", ripetizioni=RIPETIZIONI, anni=20):
+    risultati = {}
+    df = genera_dati(righe, anni=anni)
+    canale = "Google Ads"
+    mese = df["Mese"].iloc[len(df) // 2]
+    periodo = periodo_da_testo(mese)
+    da, a = periodo - 11, periodo
+
+    with tempfile.TemporaryDirectory() as cartella:
+        backend = _backend(nome_backend, cartella)
+        funnel_storage.imposta_backend(backend)
+        try:
+            risultati["save_data"] = _misura(lambda: save_data(df), ripetizioni)
+            risultati["load_data (a freddo)"] = _misura(
+                load_data, ripetizioni, prepara=lambda: funnel_storage.imposta_backend(backend)
+            )
+            risultati["load_data (in cache)"] = _misura(load_data, ripetizioni)
+
+            risultati["totali canale/mese"] = _misura(lambda: totali_funnel([canale], [mese]), ripetizioni)
+            risultati["totali intervallo 12 mesi"] = _misura(lambda: totali_intervallo([canale], da, a), ripetizioni)
+
+            totali = totali_funnel([canale])
+            righe_canale = df[df["Canale"] == canale]
+            risultati["calcola_metriche (totali)"] = _misura(lambda: calcola_metriche(totali), ripetizioni)
+            risultati["calcola_metriche (righe canale)"] = _misura(lambda: calcola_metriche(righe_canale), ripetizioni)
+
+            tassi = calcola_metriche(totali)["Tassi Conversione"]
+            # La prima figura del processo carica i validatori di plotly: resta fuori dalle misure
+            crea_grafico_funnel(totali, "Riscaldamento", tassi)
+            risultati["crea_grafico_funnel (nuovo)"] = _misura(
+                lambda: crea_grafico_funnel(totali, "Funnel", tassi), ripetizioni,
+                prepara=funnel_grafici._figura_funnel.cache_clear,
+            )
+            risultati["crea_grafico_funnel (in cache)"] = _misura(
+                lambda: crea_grafico_funnel(totali, "Funnel", tassi), ripetizioni
+            )
+
+            risultati["indice note (costruzione)"] = _misura(
+                indice_note, ripetizioni, prepara=lambda: funnel_storage._cache.pop("versione_note", None)
+            )
+            risultati["note pagina 1 (canale)"] = _misura(lambda: cerca_note([canale]), ripetizioni)
+            risultati["note pagina 1 (tutti i canali)"] = _misura(lambda: cerca_note(), ripetizioni)
+            risultati["note ricerca (canale, 12 mesi)"] = _misura(
+                lambda: cerca_note([canale], da=da, a=a, testo="budget"), ripetizioni
+            )
+
+            risultati["selectbox Modifica dati"] = _misura(lambda: cerca_record(), ripetizioni)
+            risultati["selectbox Modifica dati (ricerca)"] = _misura(
+                lambda: cerca_record([canale], testo="landing"), ripetizioni
+            )
+        finally:
+            funnel_storage.imposta_backend(funnel_storage.crea_backend())
+    return risultati
+
+
+# Funzione per conoscere il commit corrente (None fuori da un repository git)
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Funzione per eseguire il benchmark su più dimensioni e restituire il resoconto
+def esegui(dimensioni=DIMENSIONI, nome_backend="csv", ripetizioni=RIPETIZIONI, anni=20, avanzamento=print):
+    risultati = []
+    for righe in dimensioni:
+        for operazione, misura in misura_dimensione(righe, nome_backend, ripetizioni, anni).items():
+            risultati.append({"righe": righe, "operazione": operazione, **misura})
+            avanzamento(f"{righe:>10} {operazione:<36} {misura['mediana'] * 1000:12.3f} ms")
+    return {
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": sys.version.split()[0],
+        "piattaforma": platform.platform(),
+        "backend": nome_backend,
+        "ripetizioni": ripetizioni,
+        "risultati": risultati,
+    }
+
+
+# Funzione per confrontare due resoconti: restituisce le operazioni più lente di "soglia" volte
+def confronta(precedente, attuale, soglia=SOGLIA_REGRESSIONE):
+    vecchi = {(r["righe"], r["operazione"]): r["mediana"] for r in precedente["risultati"]}
+    regressioni = []
+    for risultato in attuale["risultati"]:
+        chiave = (risultato["righe"], risultato["operazione"])
+        if chiave in vecchi and vecchi[chiave] > 0:
+            rapporto = risultato["mediana"] / vecchi[chiave]
+            if rapporto > soglia:
+                regressioni.append((*chiave, vecchi[chiave], risultato["mediana"], rapporto))
+    return regressioni
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark della dashboard funnel su dati sintetici")
+    parser.add_argument("--righe", type=int, nargs="+", default=DIMENSIONI, help="Dimensioni dei dataset")
+    parser.add_argument("--backend", choices=["csv", "parquet", "sql"], default="csv")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI)
+    parser.add_argument("--anni", type=int, default=20, help="Anni coperti dai dati sintetici")
+    parser.add_argument("--output", help="File JSON dei risultati (predefinito: benchmark.json, o "
+                        "<confronta>.nuovo.json se coincide con il file da confrontare)")
+    parser.add_argument("--confronta", metavar="FILE", help="Resoconto precedente con cui confrontare")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE)
+    parser.add_argument("--genera", type=int, metavar="RIGHE", help="Genera solo un dataset sintetico")
+    parser.add_argument("--csv", default="funnel_data_sintetico.csv", help="File del dataset generato con --genera")
+    argomenti = parser.parse_args()
+
+    if argomenti.genera:
+        genera_dati(argomenti.genera, anni=argomenti.anni).to_csv(argomenti.csv, index=False)
+        print(f"{argomenti.genera} righe scritte in {argomenti.csv}")
+        sys.exit(0)
+
+    # Il resoconto precedente si legge prima di eseguire: i nuovi risultati non devono sovrascriverlo
+    precedente = None
+    output = argomenti.output or "benchmark.json"
+    if argomenti.confronta:
+        with open(argomenti.confronta, encoding="utf-8") as file:
+            precedente = json.load(file)
+        if os.path.realpath(output) == os.path.realpath(argomenti.confronta):
+            if argomenti.output:
+                parser.error("--output e --confronta indicano lo stesso file")
+            output = os.path.splitext(argomenti.confronta)[0] + ".nuovo.json"
+
+    resoconto = esegui(argomenti.righe, argomenti.backend, argomenti.ripetizioni, argomenti.anni)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(resoconto, file, ensure_ascii=False, indent=2)
+    print(f"Risultati scritti in {output}")
+
+    if precedente is not None:
+        if precedente.get("backend") != resoconto["backend"]:
+            print(f"Attenzione: confronto tra backend diversi ({precedente.get('backend')} e {resoconto['backend']})")
+        regressioni = confronta(precedente, resoconto, argomenti.soglia)
+        for righe, operazione, prima, dopo, rapporto in regressioni:
+            print(f"REGRESSIONE {righe} righe, {operazione}: {prima * 1000:.3f} ms -> {dopo * 1000:.3f} ms (x{rapporto:.2f})")
+        sys.exit(1 if regressioni else 0)
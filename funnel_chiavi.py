@@ -0,0 +1,148 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+# Oltre questo numero di righe eliminate l'indice si ricostruisce da capo
+TOMBE_MASSIME = 4096
+
+
+# Funzione per normalizzare un valore della chiave: si ignorano spazi in eccesso e maiuscole
+def _normalizza(valore):
+    return "" if pd.isna(valore) else " ".join(str(valore).split()).casefold()
+
+
+# Funzione per normalizzare la chiave di un record (Mese, Canale):
+# così "gennaio 2025" e "Gennaio 2025" coincidono
+def chiave_record(mese, canale):
+    return _normalizza(mese), _normalizza(canale)
+
+
+# Funzione per ottenere i valori normalizzati distinti di una colonna e, per ogni riga, il codice
+# del suo valore: si normalizzano solo le categorie, non le righe
+def _codici_normalizzati(colonna):
+    if not isinstance(colonna.dtype, pd.CategoricalDtype):
+        colonna = colonna.astype("category")
+    # L'ultima categoria raccoglie i valori mancanti (codice -1)
+    categorie = [_normalizza(categoria) for categoria in colonna.cat.categories] + [""]
+    codici_categorie, valori = pd.factorize(pd.Index(categorie, dtype=object))
+    codici = colonna.cat.codes.to_numpy().astype(np.int64)
+    codici[codici < 0] = len(categorie) - 1
+    return np.asarray(valori, dtype=object), codici_categorie[codici]
+
+
+# Indice hash (Mese, Canale) -> righe del DataFrame.
+# Si aggiorna operazione per operazione: trovare un record non richiede di scandire la tabella.
+# Ogni riga ha un identificativo stabile (la posizione alla costruzione, poi un contatore per
+# gli inserimenti in coda): un'eliminazione aggiunge solo l'identificativo alle "tombe", e la
+# posizione attuale si ricava togliendo le tombe che lo precedono.
+# La chiave diventa un intero (codice del mese << 32 | codice del canale): "identificativi" tiene
+# la prima riga di ogni chiave, le altre righe (solo per i duplicati già presenti nei dati
+# storici) stanno in "altre".
+class IndiceChiavi:
+    def __init__(self):
+        self.mesi = {}
+        self.canali = {}
+        self.identificativi = {}
+        self.altre = {}
+        self.tombe = []
+        self._prossimo = 0
+
+    # Funzione per costruire l'indice dalle righe del dataset (senza cicli sulle righe)
+    @classmethod
+    def da_dataframe(cls, df):
+        indice = cls()
+        indice._prossimo = len(df)
+        if not len(df):
+            return indice
+        mesi, codici_mesi = _codici_normalizzati(df["Mese"])
+        canali, codici_canali = _codici_normalizzati(df["Canale"])
+        indice.mesi = {mese: codice for codice, mese in enumerate(mesi.tolist())}
+        indice.canali = {canale: codice for codice, canale in enumerate(canali.tolist())}
+        codici = codici_mesi << 32 | codici_canali
+        # Al contrario: per le chiavi ripetute vince la prima riga
+        indice.identificativi = dict(zip(codici[::-1].tolist(), range(len(df) - 1, -1, -1)))
+        if len(indice.identificativi) < len(df):
+            ripetute = pd.Series(codici).duplicated().to_numpy()
+            for codice, identificativo in zip(codici[ripetute].tolist(), np.flatnonzero(ripetute).tolist()):
+                indice.altre.setdefault(codice, []).append(identificativo)
+        return indice
+
+    # Funzione per convertire una chiave normalizzata nel suo codice (None se mese o canale
+    # non sono mai comparsi, a meno di "crea")
+    def _codice(self, chiave, crea=False):
+        mese, canale = chiave
+        if crea:
+            return self.mesi.setdefault(mese, len(self.mesi)) << 32 | self.canali.setdefault(canale, len(self.canali))
+        if mese not in self.mesi or canale not in self.canali:
+            return None
+        return self.mesi[mese] << 32 | self.canali[canale]
+
+    # Funzione per convertire un identificativo nella posizione attuale della riga
+    def _posizione(self, identificativo):
+        return identificativo - bisect.bisect_left(self.tombe, identificativo)
+
+    # Funzione per trovare l'identificativo della riga in una posizione
+    def _identificativo(self, posizione):
+        identificativo = posizione
+        for tomba in self.tombe:
+            if tomba > identificativo:
+                break
+            identificativo += 1
+        return identificativo
+
+    # Funzione per trovare la prima riga con la chiave indicata (None se non esiste)
+    def cerca(self, mese, canale):
+        identificativo = self.identificativi.get(self._codice(chiave_record(mese, canale)))
+        return None if identificativo is None else self._posizione(identificativo)
+
+    # Funzione per ottenere le posizioni delle righe con una chiave
+    def posizioni(self, chiave):
+        codice = self._codice(chiave)
+        if codice not in self.identificativi:
+            return []
+        identificativi = [self.identificativi[codice]] + self.altre.get(codice, [])
+        return [self._posizione(identificativo) for identificativo in identificativi]
+
+    # Funzione per elencare le chiavi presenti su più righe
+    def duplicati(self):
+        mesi = {codice: mese for mese, codice in self.mesi.items()}
+        canali = {codice: canale for canale, codice in self.canali.items()}
+        return [(mesi[codice >> 32], canali[codice & 0xFFFFFFFF]) for codice in self.altre]
+
+    def _aggiungi(self, chiave, identificativo):
+        chiave = self._codice(chiave, crea=True)
+        primo = self.identificativi.setdefault(chiave, identificativo)
+        if primo != identificativo:
+            altre = self.altre.setdefault(chiave, [])
+            bisect.insort(altre, max(primo, identificativo))
+            self.identificativi[chiave] = min(primo, identificativo)
+
+    def _togli(self, chiave, identificativo):
+        chiave = self._codice(chiave)
+        if self.identificativi[chiave] != identificativo:
+            self.altre[chiave].remove(identificativo)
+        elif chiave in self.altre:
+            self.identificativi[chiave] = self.altre[chiave].pop(0)
+        else:
+            del self.identificativi[chiave]
+        if chiave in self.altre and not self.altre[chiave]:
+            del self.altre[chiave]
+
+    # Funzione per aggiornare l'indice con un'operazione del registro (prima di applicarla ai dati).
+    # "riga" è il record in posizione operazione["indice"] (None per gli inserimenti, che finiscono in coda).
+    def applica(self, riga, operazione):
+        if operazione["op"] == "inserisci":
+            valori = operazione["valori"]
+            self._aggiungi(chiave_record(valori.get("Mese"), valori.get("Canale")), self._prossimo)
+            self._prossimo += 1
+            return
+        identificativo = self._identificativo(operazione["indice"])
+        riga = {"Mese": riga["Mese"], "Canale": riga["Canale"]}
+        self._togli(chiave_record(riga["Mese"], riga["Canale"]), identificativo)
+        if operazione["op"] == "modifica":
+            riga.update({k: v for k, v in operazione["valori"].items() if k in riga})
+            self._aggiungi(chiave_record(riga["Mese"], riga["Canale"]), identificativo)
+        elif operazione["op"] == "elimina":
+            # Le righe successive scalano di una posizione senza toccare l'indice
+            bisect.insort(self.tombe, identificativo)
@@ -0,0 +1,372 @@
+import abc
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from funnel_periodi import mese_da_periodo
+from funnel_storage import indice_chiavi, salva_blocco
+
+# Richieste HTTP in volo contemporaneamente (e connessioni tenute aperte nel pool)
+CONNESSIONI_MAX = 32
+TIMEOUT_RICHIESTA = 20
+TENTATIVI_RICHIESTA = 4
+# Attesa massima tra due tentativi (anche se la piattaforma chiede di più con Retry-After)
+ATTESA_MAX = 30
+# Mesi sincronizzati di default (il mese corrente e i precedenti)
+MESI_SINCRONIZZATI = 3
+
+
+# Errore di una richiesta verso una piattaforma.
+# "transitorio" indica gli errori per cui ha senso riprovare (429, 5xx).
+class ErroreConnettore(RuntimeError):
+    def __init__(self, messaggio, transitorio=False, attesa=None):
+        super().__init__(messaggio)
+        self.transitorio = transitorio
+        self.attesa = attesa
+
+
+# Limitatore a gettoni: al massimo "raffica" richieste di fila, poi "al_secondo" richieste al secondo
+class LimitatoreRichieste:
+    def __init__(self, al_secondo, raffica):
+        self.al_secondo = al_secondo
+        self.raffica = raffica
+        self.gettoni = raffica
+        self.ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    # Funzione per attendere il proprio turno prima di una richiesta
+    async def attendi(self):
+        async with self._lock:
+            while True:
+                adesso = time.monotonic()
+                self.gettoni = min(self.raffica, self.gettoni + (adesso - self.ultimo) * self.al_secondo)
+                self.ultimo = adesso
+                if self.gettoni >= 1:
+                    self.gettoni -= 1
+                    return
+                await asyncio.sleep((1 - self.gettoni) / self.al_secondo)
+
+
+# Connettore di base: ogni piattaforma costruisce la richiesta di un mese e interpreta la risposta.
+# Credenziali e indirizzo arrivano dalle variabili FUNNEL_<PREFISSO>_TOKEN, _ACCOUNT e _URL.
+# Un connettore senza richiesta o interpreta non si può nemmeno creare.
+class Connettore(abc.ABC):
+    canale = None
+    prefisso = None
+    url_predefinito = None
+    al_secondo = 10
+    raffica = 20
+
+    def __init__(self, base_url, token, account):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.account = account
+
+    # Funzione per creare il connettore dalle variabili d'ambiente (None se non è configurato)
+    @classmethod
+    def da_ambiente(cls, base_url=None):
+        token = os.environ.get(f"FUNNEL_{cls.prefisso}_TOKEN")
+        account = os.environ.get(f"FUNNEL_{cls.prefisso}_ACCOUNT")
+        if base_url:
+            # API simulata: le credenziali non servono
+            return cls(base_url, token or "simulato", account or "1")
+        if not token or not account:
+            return None
+        return cls(os.environ.get(f"FUNNEL_{cls.prefisso}_URL", cls.url_predefinito), token, account)
+
+    # Funzione per costruire (metodo, url, opzioni di requests) della richiesta di un mese
+    @abc.abstractmethod
+    def richiesta(self, periodo):
+        pass
+
+    # Funzione per convertire la risposta JSON in {Investimento, Impression, Click}
+    @abc.abstractmethod
+    def interpreta(self, dati):
+        pass
+
+
+# Funzione per convertire un valore delle API (spesso una stringa) in numero
+def _numero(valore):
+    try:
+        return float(valore or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Funzione per il primo e l'ultimo giorno di un periodo mensile (AAAA-MM-GG)
+def _giorni(periodo):
+    return periodo.start_time.strftime("%Y-%m-%d"), periodo.end_time.strftime("%Y-%m-%d")
+
+
+class ConnettoreGoogleAds(Connettore):
+    canale = "Google Ads"
+    prefisso = "GOOGLE_ADS"
+    url_predefinito = "https://googleads.googleapis.com"
+
+    def richiesta(self, periodo):
+        inizio, fine = _giorni(periodo)
+        query = (
+            "SELECT metrics.cost_micros, metrics.impressions, metrics.clicks FROM customer "
+            f"WHERE segments.date BETWEEN '{inizio}' AND '{fine}'"
+        )
+        intestazioni = {"Authorization": f"Bearer {self.token}"}
+        if os.environ.get("FUNNEL_GOOGLE_ADS_DEVELOPER_TOKEN"):
+            intestazioni["developer-token"] = os.environ["FUNNEL_GOOGLE_ADS_DEVELOPER_TOKEN"]
+        url = f"{self.base_url}/v17/customers/{self.account}/googleAds:search"
+        return "POST", url, {"json": {"query": query}, "headers": intestazioni}
+
+    def interpreta(self, dati):
+        metriche = [risultato.get("metrics", {}) for risultato in dati.get("results", [])]
+        return {
+            "Investimento": sum(_numero(m.get("costMicros")) for m in metriche) / 1_000_000,
+            "Impression": sum(_numero(m.get("impressions")) for m in metriche),
+            "Click": sum(_numero(m.get("clicks")) for m in metriche),
+        }
+
+
+class ConnettoreFacebookAds(Connettore):
+    canale = "Facebook Ads"
+    prefisso = "FACEBOOK_ADS"
+    url_predefinito = "https://graph.facebook.com"
+
+    def richiesta(self, periodo):
+        inizio, fine = _giorni(periodo)
+        parametri = {
+            "fields": "spend,impressions,clicks",
+            "level": "account",
+            "time_range": json.dumps({"since": inizio, "until": fine}),
+            "access_token": self.token,
+        }
+        return "GET", f"{self.base_url}/v21.0/act_{self.account}/insights", {"params": parametri}
+
+    def interpreta(self, dati):
+        righe = dati.get("data", [])
+        return {
+            "Investimento": sum(_numero(riga.get("spend")) for riga in righe),
+            "Impression": sum(_numero(riga.get("impressions")) for riga in righe),
+            "Click": sum(_numero(riga.get("clicks")) for riga in righe),
+        }
+
+
+class ConnettoreLinkedInAds(Connettore):
+    canale = "LinkedIn Ads"
+    prefisso = "LINKEDIN_ADS"
+    url_predefinito = "https://api.linkedin.com"
+    al_secondo = 5
+
+    def richiesta(self, periodo):
+        fine = periodo.end_time
+        intervallo = (
+            f"(start:(year:{periodo.year},month:{periodo.month},day:1),"
+            f"end:(year:{fine.year},month:{fine.month},day:{fine.day}))"
+        )
+        account = quote(f"urn:li:sponsoredAccount:{self.account}", safe="")
+        # Rest.li vuole parentesi e due punti non codificati: la query si compone a mano
+        query = (
+            f"q=analytics&pivot=ACCOUNT&timeGranularity=ALL&dateRange={intervallo}"
+            f"&accounts=List({account})&fields=costInLocalCurrency,impressions,clicks"
+        )
+        intestazioni = {
+            "Authorization": f"Bearer {self.token}",
+            "LinkedIn-Version": "202409",
+            "X-Restli-Protocol-Version": "2.0.0",
+        }
+        return "GET", f"{self.base_url}/rest/adAnalytics?{query}", {"headers": intestazioni}
+
+    def interpreta(self, dati):
+        righe = dati.get("elements", [])
+        return {
+            "Investimento": sum(_numero(riga.get("costInLocalCurrency")) for riga in righe),
+            "Impression": sum(_numero(riga.get("impressions")) for riga in righe),
+            "Click": sum(_numero(riga.get("clicks")) for riga in righe),
+        }
+
+
+class ConnettoreEmailMarketing(Connettore):
+    canale = "Email Marketing"
+    prefisso = "EMAIL"
+    url_predefinito = "https://us1.api.mailchimp.com"
+
+    def richiesta(self, periodo):
+        inizio = periodo.start_time.strftime("%Y-%m-%dT00:00:00+00:00")
+        fine = (periodo + 1).start_time.strftime("%Y-%m-%dT00:00:00+00:00")
+        parametri = {
+            "since_send_time": inizio,
+            "before_send_time": fine,
+            "count": 1000,
+            "fields": "reports.opens.opens_total,reports.clicks.clicks_total",
+        }
+        opzioni = {"params": parametri, "auth": ("funnel", self.token)}
+        return "GET", f"{self.base_url}/3.0/reports", opzioni
+
+    # Le campagne email non hanno un costo per invio: si aggiornano solo aperture e click
+    def interpreta(self, dati):
+        report = dati.get("reports", [])
+        return {
+            "Impression": sum(_numero(r.get("opens", {}).get("opens_total")) for r in report),
+            "Click": sum(_numero(r.get("clicks", {}).get("clicks_total")) for r in report),
+        }
+
+
+CONNETTORI = [ConnettoreGoogleAds, ConnettoreFacebookAds, ConnettoreLinkedInAds, ConnettoreEmailMarketing]
+
+
+# Funzione per creare i connettori configurati (base_url punta tutti all'API simulata)
+def crea_connettori(base_url=None, canali=None):
+    connettori = [classe.da_ambiente(base_url) for classe in CONNETTORI if not canali or classe.canale in canali]
+    return [connettore for connettore in connettori if connettore is not None]
+
+
+# Funzione per gli ultimi "quanti" mesi, dal più vecchio al mese corrente
+def ultimi_mesi(quanti=MESI_SINCRONIZZATI):
+    corrente = pd.Period.now("M")
+    return [corrente - scarto for scarto in range(quanti - 1, -1, -1)]
+
+
+# Funzione per decidere se riprovare dopo un errore
+def _transitorio(errore):
+    if isinstance(errore, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return getattr(errore, "transitorio", False)
+
+
+_attesa_esponenziale = wait_random_exponential(multiplier=0.5, max=ATTESA_MAX)
+
+
+# Funzione per l'attesa tra due tentativi: Retry-After se la piattaforma lo indica
+def _attesa(stato):
+    errore = stato.outcome.exception()
+    if getattr(errore, "attesa", None) is not None:
+        return min(errore.attesa, ATTESA_MAX)
+    return _attesa_esponenziale(stato)
+
+
+# Funzione per controllare lo stato HTTP di una risposta
+def _verifica_risposta(risposta):
+    if risposta.status_code < 400:
+        return
+    transitorio = risposta.status_code == 429 or risposta.status_code >= 500
+    attesa = risposta.headers.get("Retry-After")
+    attesa = float(attesa) if attesa and attesa.replace(".", "", 1).isdigit() else None
+    raise ErroreConnettore(f"HTTP {risposta.status_code}: {risposta.text[:200]}", transitorio, attesa)
+
+
+# Funzione per scaricare un mese da una piattaforma, con limite di frequenza e nuovi tentativi.
+# La richiesta bloccante gira nel pool di thread: il ciclo asyncio resta libero per le altre.
+async def _scarica(connettore, periodo, sessione, esecutore, limitatore):
+    metodo, url, opzioni = connettore.richiesta(periodo)
+    ciclo = asyncio.get_running_loop()
+    async for tentativo in AsyncRetrying(
+        stop=stop_after_attempt(TENTATIVI_RICHIESTA),
+        wait=_attesa,
+        retry=retry_if_exception(_transitorio),
+        reraise=True,
+    ):
+        with tentativo:
+            await limitatore.attendi()
+            risposta = await ciclo.run_in_executor(
+                esecutore, partial(sessione.request, metodo, url, timeout=TIMEOUT_RICHIESTA, **opzioni)
+            )
+            _verifica_risposta(risposta)
+    return connettore.interpreta(risposta.json())
+
+
+# Funzione per creare una sessione HTTP con un pool di connessioni riutilizzate (keep-alive)
+def _sessione(connessioni):
+    sessione = requests.Session()
+    adattatore = HTTPAdapter(pool_connections=len(CONNETTORI), pool_maxsize=connessioni)
+    sessione.mount("https://", adattatore)
+    sessione.mount("http://", adattatore)
+    return sessione
+
+
+# Funzione per scaricare tutti i mesi di tutti i connettori in parallelo.
+# Restituisce (risultati {(canale, mese): metriche}, errori [(canale, mese, motivo)]).
+async def scarica_metriche(connettori, periodi, connessioni=CONNESSIONI_MAX):
+    limitatori = {connettore.canale: LimitatoreRichieste(connettore.al_secondo, connettore.raffica)
+                  for connettore in connettori}
+    lavori = [(connettore, periodo) for connettore in connettori for periodo in periodi]
+    with ThreadPoolExecutor(max_workers=connessioni) as esecutore, _sessione(connessioni) as sessione:
+        esiti = await asyncio.gather(
+            *(_scarica(connettore, periodo, sessione, esecutore, limitatori[connettore.canale])
+              for connettore, periodo in lavori),
+            return_exceptions=True,
+        )
+    risultati, errori = {}, []
+    for (connettore, periodo), esito in zip(lavori, esiti):
+        mese = mese_da_periodo(periodo)
+        if isinstance(esito, Exception):
+            errori.append((connettore.canale, mese, str(esito) or type(esito).__name__))
+        else:
+            risultati[(connettore.canale, mese)] = esito
+    return risultati, errori
+
+
+# Funzione per sincronizzare le metriche delle piattaforme nei dati funnel.
+# Si aggiornano solo le colonne scaricate (politica "aggiorna"): Lead, Vendite e Note restano invariati.
+def sincronizza(periodi=None, base_url=None, canali=None, connessioni=CONNESSIONI_MAX):
+    inizio = time.perf_counter()
+    connettori = crea_connettori(base_url, canali)
+    periodi = periodi or ultimi_mesi()
+    risultati, errori = asyncio.run(scarica_metriche(connettori, periodi, connessioni))
+
+    indice = indice_chiavi()
+    record = []
+    for (canale, mese), metriche in risultati.items():
+        # Un mese senza attività non crea un record vuoto, ma azzera quello esistente
+        if any(metriche.values()) or indice.cerca(mese, canale) is not None:
+            record.append({"Mese": mese, "Canale": canale, **metriche})
+    esiti = salva_blocco(record, politica="aggiorna") if record else {}
+    return {
+        "connettori": [connettore.canale for connettore in connettori],
+        "richieste": len(connettori) * len(periodi),
+        "record": len(record),
+        "esiti": esiti,
+        "errori": errori,
+        "secondi": time.perf_counter() - inizio,
+    }
+
+
+# Funzione per stampare il resoconto di una sincronizzazione
+def _stampa_esito(esito):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} sincronizzati {', '.join(esito['connettori']) or 'nessun canale'}: "
+          f"{esito['richieste']} richieste, {esito['record']} record "
+          f"({', '.join(f'{k} {v}' for k, v in esito['esiti'].items())}) in {esito['secondi']:.2f}s")
+    for canale, mese, motivo in esito["errori"]:
+        print(f"  {canale} {mese}: {motivo}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincronizza spesa, impression e click dalle piattaforme")
+    parser.add_argument("--mesi", type=int, default=MESI_SINCRONIZZATI, help="Mesi da sincronizzare (fino a quello corrente)")
+    parser.add_argument("--canale", action="append", choices=[c.canale for c in CONNETTORI],
+                        help="Sincronizza solo questo canale (ripetibile)")
+    parser.add_argument("--url", help="Indirizzo dell'API simulata (es. http://localhost:8765)")
+    parser.add_argument("--connessioni", type=int, default=CONNESSIONI_MAX, help="Richieste contemporanee")
+    parser.add_argument("--ogni", type=float, metavar="MINUTI",
+                        help="Ripete la sincronizzazione ogni MINUTI minuti (pianificazione fuori da Streamlit)")
+    argomenti = parser.parse_args()
+
+    while True:
+        try:
+            _stampa_esito(sincronizza(
+                ultimi_mesi(argomenti.mesi), argomenti.url, argomenti.canale, argomenti.connessioni
+            ))
+        except Exception as errore:
+            # Con la pianificazione attiva un errore non ferma le sincronizzazioni successive
+            if not argomenti.ogni:
+                raise
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} sincronizzazione fallita: {errore}")
+        if not argomenti.ogni:
+            break
+        time.sleep(argomenti.ogni * 60)
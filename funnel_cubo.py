@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+from funnel_periodi import periodo_da_testo
+
+
+# Funzione per normalizzare le chiavi (i valori mancanti diventano None)
+def _chiave(valore):
+    return None if pd.isna(valore) else valore
+
+
+# Somme cumulate per mese di un canale (o di tutti i canali): la somma di un intervallo
+# qualsiasi di mesi è la differenza tra due righe, trovate con due ricerche binarie.
+class SommePrefisse:
+    def __init__(self, larghezza):
+        self.ordinali = np.array([], dtype=np.int64)
+        # La riga k contiene la somma dei mesi prima di ordinali[k]; la prima è tutta a zero
+        self.cumulate = np.zeros((1, larghezza))
+
+    # Funzione per costruire le somme da (ordinale del mese, vettore) non ordinati
+    @classmethod
+    def da_vettori(cls, ordinali, vettori, larghezza):
+        prefissi = cls(larghezza)
+        if len(ordinali):
+            ordine = np.argsort(ordinali, kind="stable")
+            ordinali, vettori = np.asarray(ordinali)[ordine], np.asarray(vettori)[ordine]
+            prefissi.ordinali, inizi = np.unique(ordinali, return_index=True)
+            per_mese = np.add.reduceat(vettori, inizi, axis=0)
+            prefissi.cumulate = np.vstack([np.zeros((1, larghezza)), np.cumsum(per_mese, axis=0)])
+        return prefissi
+
+    # Funzione per aggiornare un mese: si corregge solo la coda delle somme da quel mese in poi
+    def aggiungi(self, ordinale, vettore):
+        k = np.searchsorted(self.ordinali, ordinale)
+        if k == len(self.ordinali) or self.ordinali[k] != ordinale:
+            self.ordinali = np.insert(self.ordinali, k, ordinale)
+            self.cumulate = np.insert(self.cumulate, k + 1, self.cumulate[k], axis=0)
+        self.cumulate[k + 1:] += vettore
+
+    # Funzione per sommare i mesi tra due ordinali (estremi inclusi, None = senza limite)
+    def somma(self, da=None, a=None):
+        inizio = 0 if da is None else np.searchsorted(self.ordinali, da, side="left")
+        fine = len(self.ordinali) if a is None else np.searchsorted(self.ordinali, a, side="right")
+        if fine <= inizio:
+            return np.zeros(self.cumulate.shape[1])
+        return self.cumulate[fine] - self.cumulate[inizio]
+
+
+# Cubo pre-aggregato per (Canale, Mese), con totali per canale, per mese e globali.
+# Ogni scrittura aggiorna solo le celle coinvolte: leggere i totali non richiede
+# di riscandire le righe, qualunque sia la dimensione dello storico.
+class CuboFunnel:
+    def __init__(self, colonne):
+        self.colonne = list(colonne)
+        self.indice = self.colonne + ["Righe"]
+        self.celle = {}
+        self.per_canale = {}
+        self.per_mese = {}
+        # Mesi di ogni canale in ordine di prima comparsa (come nel file)
+        self.mesi_per_canale = {}
+        self.mesi = {}
+        self.globale = np.zeros(len(self.indice))
+        # Somme cumulate per mese (per canale e globali) e ordinale del periodo di ogni mese testuale
+        self.prefissi_canale = {}
+        self.prefissi_globali = SommePrefisse(len(self.indice))
+        self._ordinali_mesi = {}
+
+    # Funzione per costruire il cubo dalle righe del dataset (una sola groupby)
+    @classmethod
+    def da_dataframe(cls, df, colonne):
+        gruppi = df.groupby(["Canale", "Mese"], sort=False, dropna=False, observed=True)
+        celle = gruppi[list(colonne)].sum()
+        celle["Righe"] = gruppi.size()
+        return cls.da_celle(celle.reset_index(), colonne)
+
+    # Funzione per costruire il cubo da celle già aggregate (es. GROUP BY nel database)
+    @classmethod
+    def da_celle(cls, celle, colonne):
+        cubo = cls(colonne)
+        valori = celle[cubo.indice].to_numpy(dtype="float64")
+        for canale, mese, vettore in zip(celle["Canale"], celle["Mese"], valori):
+            cubo._somma(_chiave(canale), _chiave(mese), vettore, prefissi=False)
+        cubo._costruisci_prefissi()
+        return cubo
+
+    # Funzione per ottenere l'ordinale del periodo di un mese testuale (None se non valido)
+    def _ordinale(self, mese):
+        if mese not in self._ordinali_mesi:
+            periodo = periodo_da_testo(mese) if mese is not None else pd.NaT
+            self._ordinali_mesi[mese] = None if pd.isna(periodo) else periodo.ordinal
+        return self._ordinali_mesi[mese]
+
+    # Funzione per costruire tutte le somme cumulate dalle celle in un colpo solo
+    def _costruisci_prefissi(self):
+        per_canale = {}
+        for (canale, mese), vettore in self.celle.items():
+            ordinale = self._ordinale(mese)
+            if ordinale is not None:
+                per_canale.setdefault(canale, []).append((ordinale, vettore))
+        larghezza = len(self.indice)
+        tutti = [coppia for coppie in per_canale.values() for coppia in coppie]
+        for canale, coppie in per_canale.items():
+            self.prefissi_canale[canale] = SommePrefisse.da_vettori(
+                [ordinale for ordinale, _ in coppie], [vettore for _, vettore in coppie], larghezza
+            )
+        self.prefissi_globali = SommePrefisse.da_vettori(
+            [ordinale for ordinale, _ in tutti], [vettore for _, vettore in tutti], larghezza
+        )
+
+    def _somma(self, canale, mese, vettore, prefissi=True):
+        ordinale = self._ordinale(mese)
+        if prefissi and ordinale is not None:
+            if canale not in self.prefissi_canale:
+                self.prefissi_canale[canale] = SommePrefisse(len(self.indice))
+            self.prefissi_canale[canale].aggiungi(ordinale, vettore)
+            self.prefissi_globali.aggiungi(ordinale, vettore)
+        for tabella, chiave in ((self.celle, (canale, mese)), (self.per_canale, canale), (self.per_mese, mese)):
+            if chiave in tabella:
+                tabella[chiave] = tabella[chiave] + vettore
+            else:
+                tabella[chiave] = vettore.copy()
+        self.globale = self.globale + vettore
+        if self.celle[(canale, mese)][-1] > 0:
+            self.mesi_per_canale.setdefault(canale, {}).setdefault(mese, None)
+            self.mesi.setdefault(mese, None)
+        else:
+            # Cella svuotata: sparisce anche dagli elenchi dei mesi
+            del self.celle[(canale, mese)]
+            self.mesi_per_canale.get(canale, {}).pop(mese, None)
+            if self.per_mese[mese][-1] <= 0:
+                del self.per_mese[mese]
+                self.mesi.pop(mese, None)
+            if self.per_canale[canale][-1] <= 0:
+                del self.per_canale[canale]
+
+    # Funzione per aggiungere (segno=1) o togliere (segno=-1) una riga dal cubo
+    def aggiungi(self, canale, mese, valori, segno=1):
+        vettore = np.array([float(valori.get(colonna, 0) or 0) for colonna in self.colonne] + [1.0])
+        self._somma(_chiave(canale), _chiave(mese), segno * vettore)
+
+    # Funzione per leggere i totali di un filtro (None = tutti i canali / tutti i mesi)
+    def totali(self, canali=None, mesi=None):
+        if canali is None and mesi is None:
+            vettore = self.globale
+        elif mesi is None:
+            vettore = sum((self.per_canale.get(canale, 0) for canale in canali), np.zeros(len(self.indice)))
+        elif canali is None:
+            vettore = sum((self.per_mese.get(mese, 0) for mese in mesi), np.zeros(len(self.indice)))
+        else:
+            vettore = sum(
+                (self.celle.get((canale, mese), 0) for canale in canali for mese in mesi),
+                np.zeros(len(self.indice)),
+            )
+        return pd.Series(vettore, index=self.indice, dtype="float64")
+
+    # Funzione per leggere i totali tra due periodi (estremi inclusi, None = senza limite):
+    # due ricerche binarie e una sottrazione per canale, indipendentemente dalle righe
+    def totali_intervallo(self, canali=None, da=None, a=None):
+        da = None if da is None else da.ordinal
+        a = None if a is None else a.ordinal
+        if canali is None:
+            vettore = self.prefissi_globali.somma(da, a)
+        else:
+            vettore = sum(
+                (self.prefissi_canale[canale].somma(da, a) for canale in canali if canale in self.prefissi_canale),
+                np.zeros(len(self.indice)),
+            )
+        return pd.Series(vettore, index=self.indice, dtype="float64")
+
+    # Funzione per elencare i mesi presenti per i canali indicati
+    def elenco_mesi(self, canali=None):
+        if canali is None:
+            return list(self.mesi)
+        mesi = {}
+        for canale in canali:
+            mesi.update(self.mesi_per_canale.get(canale, {}))
+        return list(mesi)
+
+    # Funzione per elencare i mesi presenti che non corrispondono a un periodo valido
+    def mesi_non_validi(self):
+        return [mese for mese in self.mesi if self._ordinale(mese) is None]
+
+    # Funzione per esportare le celle come DataFrame (una riga per coppia canale/mese)
+    def tabella(self):
+        chiavi = list(self.celle)
+        valori = np.array([self.celle[chiave] for chiave in chiavi]).reshape(len(chiavi), len(self.indice))
+        tabella = pd.DataFrame(valori, columns=self.indice)
+        tabella.insert(0, "Mese", [mese for _, mese in chiavi])
+        tabella.insert(0, "Canale", [canale for canale, _ in chiavi])
+        return tabella
@@ -0,0 +1,135 @@
+from functools import lru_cache
+
+from funnel_metriche import FASI_FUNNEL, FORMATI_METRICHE, somme_colonne
+from funnel_tracce import conta, misurata, traccia_attiva
+
+# plotly si importa solo alla prima figura: le pagine senza grafici non lo caricano mai.
+# Figure e card già costruite, per combinazione di valori: le rerun che non cambiano
+# i dati (widget, cambio pagina e ritorno) riusano quelle in memoria
+FIGURE_IN_CACHE = 64
+CARD_IN_CACHE = 256
+
+COLORI_FASI = ["#4CAF50", "#2196F3", "#FFC107", "#FF5722", "#9C27B0"]
+
+# Stile delle card: griglia a tre colonne, come le st.columns(3) di prima
+STILE_CARD = """
+<style>
+.card-griglia {
+    display: grid;
+    grid-template-columns: repeat(3, 1fr);
+}
+.card {
+    background-color: #2C2C2C;
+    color: white;
+    padding: 15px;
+    margin: 10px;
+    border-radius: 10px;
+    box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
+}
+.card-title {
+    font-size: 18px;
+    font-weight: bold;
+}
+.card-value {
+    font-size: 24px;
+    font-weight: bold;
+    color: #4CAF50;
+}
+</style>
+"""
+
+
+# Funzione per convertire un valore in una chiave della cache (None resta None)
+def _valore(valore):
+    return None if valore is None else float(valore)
+
+
+# Funzione per chiamare una funzione con cache LRU contando hit e miss nella traccia attiva
+def _con_cache(funzione, nome, *argomenti):
+    if not traccia_attiva():
+        return funzione(*argomenti)
+    mancati = funzione.cache_info().misses
+    risultato = funzione(*argomenti)
+    conta(f"{nome}.miss" if funzione.cache_info().misses > mancati else f"{nome}.hit")
+    return risultato
+
+
+@lru_cache(maxsize=FIGURE_IN_CACHE)
+def _figura_funnel(valori, titolo, tassi_conversione):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Funnel(
+        y=FASI_FUNNEL,
+        x=list(valori),
+        textposition="inside",
+        textinfo="value+percent initial",
+        marker=dict(color=COLORI_FASI)
+    ))
+
+    # Aggiunta delle percentuali sulla destra
+    for i, percentage in enumerate(tassi_conversione):
+        fig.add_annotation(
+            x=valori[i],
+            y=FASI_FUNNEL[i],
+            text=f"{percentage:.2f}%" if percentage is not None else "N/A",
+            showarrow=False,
+            xanchor="left",
+            font=dict(size=14, color="white")
+        )
+
+    fig.update_layout(
+        title=titolo,
+        font=dict(size=16),
+        plot_bgcolor="#2C2C2C",
+        paper_bgcolor="#2C2C2C",
+        font_color="white",
+        margin=dict(l=20, r=20, t=40, b=20)
+    )
+
+    return fig
+
+
+# Funzione per creare un grafico a imbuto (dalla cache se valori, tassi e titolo sono già stati visti).
+# La figura è condivisa tra le sessioni: non va modificata dopo averla ottenuta.
+@misurata("crea_grafico_funnel")
+def crea_grafico_funnel(dati, titolo, tassi_conversione):
+    valori = tuple(_valore(valore) for valore in somme_colonne(dati)[FASI_FUNNEL])
+    tassi = tuple(_valore(tasso) for tasso in tassi_conversione)
+    return _con_cache(_figura_funnel, "cache_figure", valori, titolo, tassi)
+
+
+# Funzione per caricare in anticipo plotly e i suoi validatori (la prima figura costa
+# qualche centinaio di millisecondi): la usa l'avvio a caldo, fuori dalle richieste
+def riscalda_grafici():
+    _figura_funnel.__wrapped__(tuple(range(len(FASI_FUNNEL))), "", (None,) * len(FASI_FUNNEL)).to_dict()
+
+
+# Funzione per formattare una metrica: i valori in euro hanno il simbolo €, i tassi il %
+def formatta_metrica(nome, valore):
+    if valore is None:
+        return "N/A"
+    formato = FORMATI_METRICHE.get(nome)
+    if formato == "€":
+        return f"€{valore:.2f}"
+    if formato == "%":
+        return f"{valore:.2f}%"
+    return f"{valore:.2f}"
+
+
+@lru_cache(maxsize=CARD_IN_CACHE)
+def _html_card(voci):
+    card = "".join(
+        f'<div class="card"><div class="card-title">{nome}</div>'
+        f'<div class="card-value">{formatta_metrica(nome, valore)}</div></div>'
+        for nome, valore in voci
+    )
+    return f'{STILE_CARD}<div class="card-griglia">{card}</div>'
+
+
+# Funzione per ottenere l'HTML di tutte le card delle metriche (stile compreso) in un solo blocco.
+# I tassi di conversione (liste) sono esclusi: li mostra il grafico.
+def html_card_metriche(metriche):
+    voci = tuple((nome, _valore(valore)) for nome, valore in metriche.items() if not isinstance(valore, list))
+    return _con_cache(_html_card, "cache_card", voci)
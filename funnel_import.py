@@ -0,0 +1,364 @@
+import argparse
+import csv
+import importlib.util
+import time
+
+import numpy as np
+import pandas as pd
+
+from funnel_chiavi import chiave_record
+from funnel_periodi import mese_da_periodo, periodo_da_testo
+from funnel_storage import COLONNE_NUMERICHE, POLITICHE_DUPLICATI, indice_chiavi, salva_blocco
+
+# Righe lette dal file per ogni blocco: la memoria usata non dipende dalla dimensione del file
+DIMENSIONE_BLOCCO = 50_000
+# Record (Mese, Canale) salvati per ogni scrittura sullo storage
+RECORD_PER_SCRITTURA = 500
+# Righe scartate riportate nel dettaglio (il conteggio resta completo)
+MAX_ERRORI = 1000
+# Con pyarrow i testi dei numeri da esaminare passano per le regex vettoriali di Arrow
+TESTI_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+CANALI = ["Google Ads", "Facebook Ads", "LinkedIn Ads", "Email Marketing", "Altro"]
+
+# Intestazioni riconosciute negli export delle piattaforme (confronto senza maiuscole)
+SINONIMI_COLONNE = {
+    "Mese": ["mese", "month", "mese/anno"],
+    "Data": ["data", "date", "day", "giorno", "reporting starts", "inizio report"],
+    "Canale": ["canale", "channel", "source", "fonte", "piattaforma", "platform"],
+    "Investimento": ["investimento", "spesa", "costo", "cost", "spend", "amount spent", "amount spent (eur)",
+                     "importo speso", "importo speso (eur)"],
+    "Impression": ["impression", "impressions", "impressioni", "impr."],
+    "Click": ["click", "clicks", "clic", "link clicks", "clic sul link"],
+    "Lead": ["lead", "leads", "contatti"],
+    "Assessment Fissati": ["assessment fissati"],
+    "Assessment Fatti": ["assessment fatti"],
+    "Accordi Inviati": ["accordi inviati"],
+    "Vendite": ["vendite", "sales", "purchases", "acquisti"],
+    "Valore contratti": ["valore contratti", "revenue", "fatturato", "conversion value", "valore conversioni"],
+    "Note": ["note", "notes"],
+}
+
+SINONIMI_CANALI = {
+    "Google Ads": ["google", "google ads", "adwords"],
+    "Facebook Ads": ["facebook", "facebook ads", "meta", "meta ads"],
+    "LinkedIn Ads": ["linkedin", "linkedin ads"],
+    "Email Marketing": ["email", "e-mail", "email marketing", "newsletter"],
+    "Altro": ["altro", "other", "altri"],
+}
+
+
+# Funzione per confrontare testi ignorando maiuscole e spazi in eccesso
+def _normalizza(testo):
+    return " ".join(str(testo).split()).casefold()
+
+
+_COLONNE_PER_SINONIMO = {
+    sinonimo: colonna for colonna, sinonimi in SINONIMI_COLONNE.items() for sinonimo in sinonimi
+}
+_CANALI_PER_SINONIMO = {
+    sinonimo: canale for canale, sinonimi in SINONIMI_CANALI.items() for sinonimo in sinonimi
+}
+
+
+# Funzione per associare le intestazioni del file alle colonne del funnel.
+# "mappa" ({intestazione: colonna}) ha la precedenza sui sinonimi.
+def mappa_colonne(intestazioni, mappa=None):
+    forzate = {_normalizza(intestazione): colonna for intestazione, colonna in (mappa or {}).items()}
+    associazioni = {}
+    for intestazione in intestazioni:
+        chiave = _normalizza(intestazione)
+        colonna = forzate.get(chiave, _COLONNE_PER_SINONIMO.get(chiave))
+        if colonna is not None and colonna not in associazioni.values():
+            associazioni[intestazione] = colonna
+    return associazioni
+
+
+# Funzione per indovinare il separatore di un CSV (gli export italiani usano spesso ";")
+def _separatore(sorgente, encoding):
+    if hasattr(sorgente, "read"):
+        campione = sorgente.read(65536)
+        sorgente.seek(0)
+    else:
+        with open(sorgente, "rb") as f:
+            campione = f.read(65536)
+    if isinstance(campione, bytes):
+        campione = campione.decode(encoding, errors="replace")
+    try:
+        return csv.Sniffer().sniff(campione, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+# Funzione per sapere se un export è un foglio Excel (dal nome del file)
+def _excel(nome):
+    return nome.lower().endswith((".xlsx", ".xlsm"))
+
+
+# Funzione per la convenzione dei numeri suggerita dal formato del file, usata quando i valori
+# di una colonna non la rivelano: i CSV con ";" sono export italiani (1.234,50), mentre le celle
+# numeriche di Excel arrivano come testo con il punto decimale
+def convenzione_file(sorgente, nome=None, encoding="utf-8-sig"):
+    nome = nome or getattr(sorgente, "name", str(sorgente))
+    if _excel(nome):
+        return "en"
+    return "it" if _separatore(sorgente, encoding) == ";" else None
+
+
+# Funzione per leggere un foglio Excel a blocchi senza caricarlo tutto (openpyxl in sola lettura)
+def _blocchi_excel(sorgente, dimensione):
+    import openpyxl
+
+    libro = openpyxl.load_workbook(sorgente, read_only=True, data_only=True)
+    try:
+        righe = libro.active.iter_rows(values_only=True)
+        intestazione = [str(valore) if valore is not None else f"colonna {i}" for i, valore in enumerate(next(righe, ()))]
+        blocco = []
+        for riga in righe:
+            blocco.append(riga[:len(intestazione)])
+            if len(blocco) == dimensione:
+                yield pd.DataFrame(blocco, columns=intestazione, dtype=object)
+                blocco = []
+        if blocco:
+            yield pd.DataFrame(blocco, columns=intestazione, dtype=object)
+    finally:
+        libro.close()
+
+
+# Funzione per leggere un export CSV o Excel a blocchi di righe (tutti i valori come testo)
+def leggi_a_blocchi(sorgente, nome=None, dimensione=DIMENSIONE_BLOCCO, encoding="utf-8-sig"):
+    nome = nome or getattr(sorgente, "name", str(sorgente))
+    if _excel(nome):
+        blocchi = _blocchi_excel(sorgente, dimensione)
+    else:
+        blocchi = pd.read_csv(
+            sorgente, sep=_separatore(sorgente, encoding), dtype=str, encoding=encoding,
+            chunksize=dimensione, skipinitialspace=True,
+        )
+    for blocco in blocchi:
+        yield blocco.astype("string")
+
+
+# Funzione per convertire i valori numerici degli export in float (NaN se non validi).
+# "convenzione" indica il separatore dei decimali della colonna: "it" (1.234,50), "en" (1,234.50)
+# o None se non è noto. I numeri semplici passano dalla conversione vettoriale; quelli con
+# separatori ("1.234,50", "€ 12,5", "1.000") vengono esaminati come testo. Un separatore dopo
+# l'altro, o non seguito da un gruppo di tre cifre, è quello dei decimali; più gruppi di tre cifre
+# ("12.345.678") sono migliaia. Un valore come "1.000" senza convenzione può essere mille o uno:
+# resta NaN e viene segnalato come ambiguo.
+# Restituisce (numeri, maschera degli ambigui, convenzione rivelata dai valori o None).
+def _numeri(testi, convenzione=None):
+    numeri = pd.Series(
+        pd.to_numeric(testi, errors="coerce").to_numpy(dtype="float64", na_value=np.nan), index=testi.index
+    )
+    ambigui = np.zeros(len(testi), dtype=bool)
+    # Dei valori già convertiti con un punto, solo quelli con tre cifre dopo l'ultimo punto
+    # ("1.000") possono avere il punto delle migliaia; gli altri ("2.5") hanno il punto decimale
+    convertiti = numeri.notna().to_numpy()
+    con_punto = convertiti & testi.str.contains(".", regex=False).fillna(False).to_numpy()
+    forma_migliaia = np.zeros(len(testi), dtype=bool)
+    if con_punto.any():
+        forma_migliaia[con_punto] = testi[con_punto].str.contains(r"\.\d{3}\s*$").to_numpy()
+    punto_decimale = bool((con_punto & ~forma_migliaia).any())
+    da_esaminare = (~convertiti & testi.notna().to_numpy()) | forma_migliaia
+    if not da_esaminare.any():
+        return numeri, ambigui, "en" if punto_decimale else None
+    sporchi = testi[da_esaminare]
+    if TESTI_ARROW:
+        sporchi = sporchi.astype("string[pyarrow]")
+    sporchi = sporchi.str.replace(r"[^\d,.\-]", "", regex=True)
+    # L'ultimo separatore del valore, le migliaia possibili ("1.000") e quelle certe ("12.345.678")
+    fine_virgola = sporchi.str.contains(r",\d*$").fillna(False)
+    fine_punto = sporchi.str.contains(r"\.\d*$").fillna(False)
+    con_virgola = sporchi.str.contains(",", regex=False).fillna(False)
+    con_punto = sporchi.str.contains(".", regex=False).fillna(False)
+    migliaia_punto = sporchi.str.fullmatch(r"-?\d{1,3}(?:\.\d{3})+").fillna(False)
+    migliaia_virgola = sporchi.str.fullmatch(r"-?\d{1,3}(?:,\d{3})+").fillna(False)
+    gruppi_punto = sporchi.str.fullmatch(r"-?\d{1,3}(?:\.\d{3}){2,}").fillna(False)
+    gruppi_virgola = sporchi.str.fullmatch(r"-?\d{1,3}(?:,\d{3}){2,}").fillna(False)
+    italiani = (fine_virgola & (con_punto | ~migliaia_virgola)) | gruppi_punto
+    inglesi = (fine_punto & (con_virgola | ~migliaia_punto)) | gruppi_virgola
+    rivelata = None
+    if italiani.any() != (inglesi.any() or punto_decimale):
+        rivelata = "it" if italiani.any() else "en"
+    convenzione = rivelata or convenzione
+    incerti = (migliaia_punto | migliaia_virgola) & ~italiani & ~inglesi
+    if convenzione is None:
+        ambigui[da_esaminare] = incerti.to_numpy()
+    virgola_decimale = italiani | (incerti & (convenzione == "it"))
+    testi_italiani = sporchi.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    testi_inglesi = sporchi.str.replace(",", "", regex=False)
+    puliti = pd.to_numeric(testi_italiani.where(virgola_decimale, testi_inglesi), errors="coerce")
+    # Dei valori già convertiti si correggono solo quelli con il punto delle migliaia
+    da_correggere = (numeri[da_esaminare].isna() | migliaia_punto).to_numpy()
+    numeri.iloc[np.flatnonzero(da_esaminare)[da_correggere]] = puliti.to_numpy(dtype="float64", na_value=np.nan)[da_correggere]
+    numeri[ambigui] = np.nan
+    return numeri, ambigui, rivelata
+
+
+# Funzione per interpretare ogni valore distinto una sola volta (anche tra blocchi diversi)
+def _converti_distinti(valori, converti, memo):
+    for valore in valori.dropna().unique():
+        if valore not in memo:
+            memo[valore] = converti(valore)
+    return valori.map(memo).astype("string")
+
+
+# Funzione per convertire una data o un mese nel testo della colonna "Mese" ("Gennaio 2025")
+def _mese(valore):
+    periodo = periodo_da_testo(valore)
+    if pd.isna(periodo):
+        # Le date ISO (2025-01-31) iniziano con l'anno, le altre con il giorno (31/01/2025)
+        data = pd.to_datetime(valore, dayfirst=not str(valore)[:4].isdigit(), errors="coerce")
+        periodo = pd.NaT if pd.isna(data) else data.to_period("M")
+    return None if pd.isna(periodo) else mese_da_periodo(periodo)
+
+
+# Funzione per riportare il nome di un canale a quello usato nel funnel (se riconosciuto)
+def _canale(valore):
+    return _CANALI_PER_SINONIMO.get(_normalizza(valore), valore)
+
+
+# Funzione per validare e convertire un blocco di righe.
+# Restituisce le righe valide (colonne del funnel) e l'elenco (riga, motivo) delle scartate.
+# "memo" conserva le conversioni di mesi e canali e la convenzione dei numeri di ogni colonna
+# da un blocco all'altro; "convenzione" è quella del file, per le colonne che non la rivelano.
+def valida_blocco(blocco, associazioni, canale=None, prima_riga=2, memo=None, convenzione=None):
+    memo = {"mesi": {}, "canali": {}, "numeri": {}} if memo is None else memo
+    dati = blocco[list(associazioni)].rename(columns=associazioni)
+    motivi = pd.Series(pd.NA, index=dati.index, dtype="string")
+
+    def scarta(maschera, motivo):
+        motivi[maschera & motivi.isna()] = motivo
+
+    # Mese: colonna testuale o data giornaliera (ricondotta al mese)
+    origine = dati["Mese"] if "Mese" in dati.columns else dati["Data"]
+    mesi = _converti_distinti(origine, _mese, memo["mesi"])
+    scarta(mesi.isna(), "mese o data non riconosciuti")
+
+    if canale is not None:
+        canali = pd.Series(canale, index=dati.index, dtype="string")
+    else:
+        canali = _converti_distinti(dati["Canale"], _canale, memo["canali"])
+        scarta(canali.isna(), "canale mancante")
+        scarta(~canali.isin(CANALI) & canali.notna(), "canale sconosciuto")
+
+    valide = pd.DataFrame({"Mese": mesi, "Canale": canali}, index=dati.index)
+    for colonna in COLONNE_NUMERICHE:
+        if colonna not in dati.columns:
+            valide[colonna] = 0.0
+            continue
+        numeri, ambigui, rivelata = _numeri(dati[colonna], memo["numeri"].get(colonna) or convenzione)
+        if rivelata is not None:
+            memo["numeri"].setdefault(colonna, rivelata)
+        scarta(pd.Series(ambigui, index=dati.index), f"valore ambiguo in {colonna} (punto o virgola delle migliaia?)")
+        scarta(numeri.isna() & dati[colonna].notna(), f"valore non numerico in {colonna}")
+        scarta(numeri < 0, f"valore negativo in {colonna}")
+        valide[colonna] = numeri.fillna(0).astype("float64")
+    valide["Note"] = dati["Note"].fillna("") if "Note" in dati.columns else ""
+
+    scartate = motivi.notna().to_numpy()
+    righe_scartate = np.flatnonzero(scartate) + prima_riga
+    errori = list(zip(righe_scartate.tolist(), motivi[scartate].tolist()))
+    return valide[~scartate], errori
+
+
+# Funzione per importare un export (CSV o Excel) nello storage.
+# Il file viene letto a blocchi e le righe valide vengono sommate per (Mese, Canale), così
+# anche righe giornaliere diventano un record mensile per canale; i record vengono poi salvati
+# a gruppi con salva_blocco secondo la politica scelta ("rifiuta" salta i record già presenti).
+def importa(sorgente, nome=None, canale=None, mappa=None, politica="unisci",
+            dimensione_blocco=DIMENSIONE_BLOCCO, encoding="utf-8-sig", avanzamento=None):
+    if politica not in POLITICHE_DUPLICATI:
+        raise ValueError(f"Politica sconosciuta: {politica} (attese: {', '.join(POLITICHE_DUPLICATI)})")
+    if canale is not None and canale not in CANALI:
+        raise ValueError(f"Canale sconosciuto: {canale} (attesi: {', '.join(CANALI)})")
+    inizio = time.perf_counter()
+    esito = {"righe_lette": 0, "righe_valide": 0, "righe_scartate": 0, "errori": [], "colonne_ignorate": [],
+             "record": 0, "esiti": {"inserito": 0, "unito": 0, "sostituito": 0, "aggiornato": 0, "saltato": 0}}
+    # Totali per (Mese, Canale): la memoria dipende dal numero di mesi e canali, non dalle righe
+    totali = {}
+    associazioni = None
+    memo = {"mesi": {}, "canali": {}, "numeri": {}}
+    convenzione = convenzione_file(sorgente, nome=nome, encoding=encoding)
+    for blocco in leggi_a_blocchi(sorgente, nome=nome, dimensione=dimensione_blocco, encoding=encoding):
+        if associazioni is None:
+            associazioni = mappa_colonne(blocco.columns, mappa)
+            esito["colonne_ignorate"] = [colonna for colonna in blocco.columns if colonna not in associazioni]
+            trovate = set(associazioni.values())
+            if not trovate & {"Mese", "Data"}:
+                raise ValueError("Nel file manca una colonna con il mese o la data")
+            if canale is None and "Canale" not in trovate:
+                raise ValueError("Nel file manca la colonna del canale: indica il canale di tutte le righe")
+        valide, errori = valida_blocco(
+            blocco, associazioni, canale, prima_riga=esito["righe_lette"] + 2, memo=memo, convenzione=convenzione
+        )
+        esito["righe_lette"] += len(blocco)
+        esito["righe_valide"] += len(valide)
+        esito["righe_scartate"] += len(errori)
+        esito["errori"].extend(errori[:MAX_ERRORI - len(esito["errori"])])
+        gruppi = valide.groupby(["Mese", "Canale"], sort=False)
+        somme = gruppi[COLONNE_NUMERICHE].sum()
+        note = {chiave: [testo for testo in testi.unique() if testo.strip()] for chiave, testi in gruppi["Note"]}
+        for chiave, vettore in zip(somme.index, somme.to_numpy()):
+            if chiave in totali:
+                totali[chiave][0] += vettore
+                totali[chiave][1].extend(nota for nota in note[chiave] if nota not in totali[chiave][1])
+            else:
+                totali[chiave] = [vettore.copy(), list(note[chiave])]
+        if avanzamento is not None:
+            avanzamento(esito["righe_lette"])
+
+    # Solo le colonne presenti nel file: con "aggiorna" le altre restano come sono
+    presenti = set((associazioni or {}).values())
+    record = []
+    for (mese, canale_record), (vettore, note) in totali.items():
+        valori = {"Mese": mese, "Canale": canale_record}
+        valori.update(
+            (colonna, valore) for colonna, valore in zip(COLONNE_NUMERICHE, vettore.tolist()) if colonna in presenti
+        )
+        if "Note" in presenti:
+            valori["Note"] = "; ".join(note)
+        record.append(valori)
+    if politica == "rifiuta":
+        # I record già presenti vengono segnalati e saltati, non annullano l'import
+        indice = indice_chiavi()
+        presenti = [valori for valori in record if indice.cerca(valori["Mese"], valori["Canale"]) is not None]
+        esito["esiti"]["saltato"] = len(presenti)
+        saltati = {chiave_record(valori["Mese"], valori["Canale"]) for valori in presenti}
+        record = [valori for valori in record if chiave_record(valori["Mese"], valori["Canale"]) not in saltati]
+    for inizio_gruppo in range(0, len(record), RECORD_PER_SCRITTURA):
+        esiti = salva_blocco(record[inizio_gruppo:inizio_gruppo + RECORD_PER_SCRITTURA], politica=politica)
+        for chiave, numero in esiti.items():
+            esito["esiti"][chiave] += numero
+    esito["record"] = len(totali)
+    esito["secondi"] = time.perf_counter() - inizio
+    return esito
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa un export CSV o Excel nei dati funnel")
+    parser.add_argument("file", help="File .csv, .xlsx o .xlsm")
+    parser.add_argument("--canale", choices=CANALI, help="Canale di tutte le righe (se il file non ha la colonna)")
+    parser.add_argument("--politica", choices=POLITICHE_DUPLICATI, default="unisci",
+                        help="Cosa fare se il mese esiste già per il canale")
+    parser.add_argument("--mappa", action="append", default=[], metavar="INTESTAZIONE=COLONNA",
+                        help="Associa un'intestazione del file a una colonna del funnel (ripetibile)")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Righe lette per blocco")
+    parser.add_argument("--encoding", default="utf-8-sig", help="Codifica del CSV (es. cp1252)")
+    argomenti = parser.parse_args()
+
+    mappa = dict(voce.split("=", 1) for voce in argomenti.mappa)
+    esito = importa(
+        argomenti.file, canale=argomenti.canale, mappa=mappa, politica=argomenti.politica,
+        dimensione_blocco=argomenti.blocco, encoding=argomenti.encoding,
+        avanzamento=lambda righe: print(f"\r{righe} righe lette", end="", flush=True),
+    )
+    print()
+    print(f"Righe valide {esito['righe_valide']} su {esito['righe_lette']}, scartate {esito['righe_scartate']}.")
+    print(f"Record mese/canale: {esito['record']} ({', '.join(f'{k} {v}' for k, v in esito['esiti'].items())}) "
+          f"in {esito['secondi']:.1f}s.")
+    if esito["colonne_ignorate"]:
+        print(f"Colonne ignorate: {', '.join(esito['colonne_ignorate'])}")
+    for riga, motivo in esito["errori"][:20]:
+        print(f"  riga {riga}: {motivo}")
@@ -0,0 +1,98 @@
+import pandas as pd
+
+# Fasi del funnel, nell'ordine del grafico
+FASI_FUNNEL = ["Lead", "Assessment Fissati", "Assessment Fatti", "Accordi Inviati", "Vendite"]
+
+# Nomi dei tassi di conversione tra una fase e la successiva (stesso ordine di "Tassi Conversione")
+NOMI_CONVERSIONI = [
+    "Conversione Click → Lead",
+    "Conversione Lead → Assessment Fissati",
+    "Conversione Assessment Fissati → Fatti",
+    "Conversione Assessment Fatti → Accordi",
+    "Conversione Accordi → Vendite",
+]
+
+# Formato di visualizzazione di ogni metrica: euro o percentuale
+FORMATI_METRICHE = {
+    "Investimento Totale": "€",
+    "CPC (Costo per Click)": "€",
+    "CPL (Costo per Lead)": "€",
+    "Tasso di conversione Landing": "%",
+    "CAC (Costo Cliente)": "€",
+    "Valore contratti": "€",
+}
+FORMATI_METRICHE.update({nome: "%" for nome in NOMI_CONVERSIONI})
+
+
+# Funzione per ottenere le somme per colonna (da un DataFrame o da totali già aggregati)
+def somme_colonne(dati):
+    if isinstance(dati, pd.DataFrame):
+        return dati.sum(numeric_only=True)
+    return dati
+
+
+# Funzione per calcolare le metriche (accetta le righe filtrate o i totali aggregati)
+def calcola_metriche(dati, globale=False):
+    totali = somme_colonne(dati)
+    investimento_totale = totali["Investimento"]
+    lead_totali = totali["Lead"]
+    vendite_totali = totali["Vendite"]
+    cpl = investimento_totale / lead_totali if lead_totali > 0 else None
+    cac = investimento_totale / vendite_totali if vendite_totali > 0 else None
+
+    click_totali = totali["Click"]
+    impression_totali = totali["Impression"]
+    conversione_landing = (click_totali / impression_totali) * 100 if impression_totali > 0 else None
+    cpc = investimento_totale / click_totali if click_totali > 0 else None
+
+    valore_contratti_totale = totali["Valore contratti"]
+
+    metriche = {
+        "Investimento Totale": investimento_totale,
+        "CPC (Costo per Click)": cpc,
+        "CPL (Costo per Lead)": cpl,
+        "Tasso di conversione Landing": conversione_landing,
+        "CAC (Costo Cliente)": cac,
+        "Valore contratti": valore_contratti_totale,
+    }
+
+    # Calcolo dei tassi di conversione per le varie fasi
+    conversione_lead = (lead_totali / click_totali) * 100 if click_totali > 0 else None
+    conversione_assessment_fissati = (totali["Assessment Fissati"] / lead_totali) * 100 if lead_totali > 0 else None
+    conversione_assessment_fatti = (totali["Assessment Fatti"] / totali["Assessment Fissati"]) * 100 if totali["Assessment Fissati"] > 0 else None
+    conversione_accordi = (totali["Accordi Inviati"] / totali["Assessment Fatti"]) * 100 if totali["Assessment Fatti"] > 0 else None
+    conversione_vendite = (vendite_totali / totali["Accordi Inviati"]) * 100 if totali["Accordi Inviati"] > 0 else None
+
+    metriche["Tassi Conversione"] = [
+        conversione_lead,
+        conversione_assessment_fissati,
+        conversione_assessment_fatti,
+        conversione_accordi,
+        conversione_vendite,
+    ]
+
+    return metriche
+
+
+# Funzione per dividere due colonne: con denominatore nullo il risultato è NaN
+# (l'equivalente vettoriale del None restituito da calcola_metriche)
+def _rapporto(numeratore, denominatore, scala=1):
+    return numeratore / denominatore.where(denominatore > 0) * scala
+
+
+# Funzione per calcolare tutte le metriche su molte righe di totali in un solo passaggio.
+# "totali" ha una riga per gruppo (es. una per ogni coppia canale/mese) e le colonne
+# numeriche già sommate; il risultato ha una colonna per metrica, con lo stesso indice.
+def tabella_metriche(totali):
+    investimento = totali["Investimento"]
+    metriche = pd.DataFrame(index=totali.index)
+    metriche["Investimento Totale"] = investimento
+    metriche["CPC (Costo per Click)"] = _rapporto(investimento, totali["Click"])
+    metriche["CPL (Costo per Lead)"] = _rapporto(investimento, totali["Lead"])
+    metriche["Tasso di conversione Landing"] = _rapporto(totali["Click"], totali["Impression"], 100)
+    metriche["CAC (Costo Cliente)"] = _rapporto(investimento, totali["Vendite"])
+    metriche["Valore contratti"] = totali["Valore contratti"]
+    fasi_precedenti = ["Click"] + FASI_FUNNEL[:-1]
+    for nome, fase, precedente in zip(NOMI_CONVERSIONI, FASI_FUNNEL, fasi_precedenti):
+        metriche[nome] = _rapporto(totali[fase], totali[precedente], 100)
+    return metriche
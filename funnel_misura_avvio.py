@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Misura del tempo di avvio: importazione di ogni modulo (ognuno in un interprete nuovo,
+# come dopo il riavvio di un worker) e tempo fino al primo rendering delle pagine,
+# a freddo e dopo la preparazione di funnel_avvio.py.
+# Esempio: python funnel_misura_avvio.py --json avvio.json
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+MODULI = [
+    "streamlit", "pandas", "numpy", "pyarrow", "plotly.graph_objects",
+    "matplotlib.pyplot", "sklearn.linear_model", "docx",
+    "funnel_storage", "funnel_grafici", "funnel_import", "funnel_metriche", "funnel_tracce",
+    "funnel_previsioni", "funnel_report",
+]
+PAGINE = ["Inserisci dati", "Globale"]
+
+
+# Funzione per misurare l'importazione di un modulo in un interprete nuovo (secondi, None se manca)
+def tempo_importazione(modulo):
+    esito = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True, text=True, cwd=CARTELLA,
+    )
+    if esito.returncode != 0:
+        return None
+    for riga in reversed(esito.stderr.splitlines()):
+        parti = riga.split("|")
+        if len(parti) == 3 and parti[2].strip() == modulo:
+            return int(parti[1]) / 1_000_000
+    return None
+
+
+# Funzione per misurare la prima figura plotly: l'importazione è pigra, il costo vero
+# (validatori delle tracce e del layout) si paga alla prima figura costruita
+def tempo_prima_figura():
+    codice = (
+        "import time, funnel_grafici; inizio = time.perf_counter(); "
+        "funnel_grafici.riscalda_grafici(); print(time.perf_counter() - inizio)"
+    )
+    esito = subprocess.run([sys.executable, "-c", codice], capture_output=True, text=True, cwd=CARTELLA)
+    return float(esito.stdout.strip()) if esito.returncode == 0 else None
+
+
+# Funzione eseguita nel processo figlio: tempo del primo rendering di ogni pagina (AppTest)
+def _misura_rendering(caldo):
+    sys.path.insert(0, CARTELLA)
+    from streamlit.testing.v1 import AppTest
+
+    risultati = {}
+    if caldo:
+        from funnel_avvio import prepara_dati
+        from funnel_grafici import riscalda_grafici
+
+        inizio = time.perf_counter()
+        prepara_dati()
+        riscalda_grafici()
+        risultati["preparazione all'avvio"] = time.perf_counter() - inizio
+    app = AppTest.from_file(os.path.join(CARTELLA, "funnel_app.py"), default_timeout=120)
+    for numero, pagina in enumerate(PAGINE):
+        inizio = time.perf_counter()
+        if numero == 0:
+            app.run()
+        else:
+            app.sidebar.radio[0].set_value(pagina).run()
+        risultati[f"primo rendering: {pagina}"] = time.perf_counter() - inizio
+        if app.exception:
+            raise RuntimeError(f"{pagina}: {app.exception[0].message}")
+    print(json.dumps(risultati))
+
+
+# Funzione per misurare il primo rendering in un interprete nuovo (a freddo o dopo la preparazione)
+def tempo_rendering(caldo):
+    esito = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--figlio", "caldo" if caldo else "freddo"],
+        capture_output=True, text=True, cwd=os.getcwd(),
+    )
+    if esito.returncode != 0:
+        raise RuntimeError(esito.stderr.strip().splitlines()[-1])
+    return json.loads(esito.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Misura importazioni e primo rendering della dashboard")
+    parser.add_argument("--json", metavar="FILE", help="Scrive anche i risultati in un file JSON")
+    parser.add_argument("--figlio", choices=["freddo", "caldo"], help=argparse.SUPPRESS)
+    argomenti = parser.parse_args()
+
+    if argomenti.figlio:
+        _misura_rendering(argomenti.figlio == "caldo")
+        sys.exit(0)
+
+    resoconto = {"importazioni": {}, "a freddo": {}, "avvio a caldo": {}}
+    print("Importazione (interprete nuovo):")
+    for modulo in MODULI:
+        secondi = tempo_importazione(modulo)
+        resoconto["importazioni"][modulo] = secondi
+        print(f"  {modulo:<24} {'non installato' if secondi is None else f'{secondi * 1000:8.1f} ms'}")
+    secondi = tempo_prima_figura()
+    resoconto["importazioni"]["plotly (prima figura)"] = secondi
+    print(f"  {'plotly (prima figura)':<24} {'non installato' if secondi is None else f'{secondi * 1000:8.1f} ms'}")
+    for nome, caldo in (("a freddo", False), ("avvio a caldo", True)):
+        print(f"Primo rendering, {nome} (streamlit già importato, come nel server):")
+        resoconto[nome] = tempo_rendering(caldo)
+        for voce, secondi in resoconto[nome].items():
+            print(f"  {voce:<32} {secondi * 1000:8.1f} ms")
+
+    if argomenti.json:
+        with open(argomenti.json, "w", encoding="utf-8") as file:
+            json.dump(resoconto, file, ensure_ascii=False, indent=2)
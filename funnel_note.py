@@ -0,0 +1,131 @@
+import re
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from funnel_periodi import ORDINALE_NAT
+
+_PAROLA = re.compile(r"\w+")
+
+
+# Funzione per normalizzare un testo per la ricerca: minuscole e senza accenti ("Attività" -> "attivita")
+def normalizza_testo(testo):
+    testo = str(testo).casefold()
+    if testo.isascii():
+        return testo
+    scomposto = unicodedata.normalize("NFKD", testo)
+    return "".join(carattere for carattere in scomposto if not unicodedata.combining(carattere))
+
+
+# Funzione per dividere un testo nelle parole indicizzate
+def parole(testo):
+    return _PAROLA.findall(normalizza_testo(testo))
+
+
+# Indice delle note, separato dalle colonne numeriche: contiene solo le righe con una nota,
+# già ordinate dalla più recente (per periodo, poi per posizione) e un indice invertito
+# parola -> righe. Le liste delle parole sono contigue in un solo array, nell'ordine
+# alfabetico del vocabolario: le parole con lo stesso prefisso sono un'unica fetta.
+# Una ricerca interseca poche liste ordinate; una pagina si ritaglia dal risultato.
+class IndiceNote:
+    def __init__(self, df):
+        codici_note, testi = pd.factorize(df["Note"], use_na_sentinel=True)
+        valide = np.array([isinstance(testo, str) and bool(testo.strip()) for testo in testi], dtype=bool)
+        righe = np.flatnonzero(valide[codici_note] & (codici_note >= 0)) if len(testi) else np.array([], dtype=np.int64)
+
+        # Dalla più recente: periodo decrescente, mesi non validi in fondo, poi ultima riga inserita
+        ordinali = df["Periodo"].array.asi8[righe] if "Periodo" in df.columns else np.full(len(righe), ORDINALE_NAT)
+        ordine = np.lexsort((-righe, -ordinali.astype(np.float64)))
+        self.posizioni = righe[ordine]
+        self.ordinali = ordinali[ordine]
+        canali = df["Canale"].astype("category").cat
+        mesi = df["Mese"].astype("category").cat
+        self.nomi_canali, self.codici_canali = canali.categories, canali.codes.to_numpy()[self.posizioni]
+        self.nomi_mesi, self.codici_mesi = mesi.categories, mesi.codes.to_numpy()[self.posizioni]
+        self.codici_testi = codici_note[self.posizioni]
+        self.testi = testi
+
+        # Ogni testo distinto si divide in parole una volta sola, poi si espande alle sue righe
+        coppie_parole, coppie_testi = [], []
+        elenco_testi = testi.tolist()
+        for codice in np.unique(self.codici_testi).tolist():
+            for parola in set(parole(elenco_testi[codice])):
+                coppie_parole.append(parola)
+                coppie_testi.append(codice)
+        # Codici delle parole nell'ordine alfabetico del vocabolario (si ordinano solo le parole distinte)
+        id_parole, distinte = pd.factorize(np.array(coppie_parole, dtype=object))
+        ordine_alfabetico = np.argsort(distinte)
+        self.vocabolario = distinte[ordine_alfabetico].tolist()
+        rango = np.empty(len(distinte), dtype=np.int64)
+        rango[ordine_alfabetico] = np.arange(len(distinte))
+        id_parole = rango[id_parole]
+        ordine_testi = np.argsort(self.codici_testi, kind="stable")
+        confini = np.searchsorted(self.codici_testi[ordine_testi], np.arange(len(testi) + 1))
+        coppie_testi = np.array(coppie_testi, dtype=np.int64)
+        lunghezze = confini[coppie_testi + 1] - confini[coppie_testi]
+        # Indici delle righe di ogni coppia (parola, testo), senza cicli Python
+        scostamenti = np.repeat(confini[coppie_testi] - (np.cumsum(lunghezze) - lunghezze), lunghezze)
+        righe_coppie = ordine_testi[scostamenti + np.arange(lunghezze.sum())]
+        parole_coppie = np.repeat(id_parole, lunghezze)
+        ordine = np.lexsort((righe_coppie, parole_coppie))
+        self.liste = righe_coppie[ordine]
+        self.inizi = np.searchsorted(parole_coppie[ordine], np.arange(len(self.vocabolario) + 1))
+
+    def __len__(self):
+        return len(self.posizioni)
+
+    # Funzione per trovare le note con una parola che inizia per "prefisso" (ordinate)
+    def _con_prefisso(self, prefisso):
+        inizio = bisect_left(self.vocabolario, prefisso)
+        fine = bisect_left(self.vocabolario, prefisso + "\U0010ffff", lo=inizio)
+        trovate = self.liste[self.inizi[inizio]:self.inizi[fine]]
+        return trovate if fine - inizio <= 1 else np.unique(trovate)
+
+    # Funzione per trovare le righe del dataset (posizioni ordinate) con una nota che contiene
+    # una parola che inizia per "prefisso"
+    def righe(self, prefisso):
+        return np.sort(self.posizioni[self._con_prefisso(prefisso)])
+
+    # Funzione per cercare le note che contengono tutte le parole del testo (ognuna anche come
+    # inizio di parola), filtrate per canali, mesi testuali o periodi (da/a inclusi).
+    # Restituisce gli indici interni in ordine dalla più recente.
+    def cerca(self, testo=None, canali=None, mesi=None, da=None, a=None):
+        trovate = None
+        for parola in sorted(set(parole(testo or "")), key=len, reverse=True):
+            corrispondenze = self._con_prefisso(parola)
+            trovate = corrispondenze if trovate is None else np.intersect1d(trovate, corrispondenze, assume_unique=True)
+            if not len(trovate):
+                return trovate
+        if trovate is None:
+            trovate = np.arange(len(self.posizioni))
+        if canali is not None:
+            codici = np.flatnonzero(self.nomi_canali.isin(canali))
+            trovate = trovate[np.isin(self.codici_canali[trovate], codici)]
+        if mesi is not None:
+            codici = np.flatnonzero(self.nomi_mesi.isin(mesi))
+            trovate = trovate[np.isin(self.codici_mesi[trovate], codici)]
+        if da is not None or a is not None:
+            ordinali = self.ordinali[trovate]
+            dentro = ordinali != ORDINALE_NAT
+            if da is not None:
+                dentro &= ordinali >= da.ordinal
+            if a is not None:
+                dentro &= ordinali <= a.ordinal
+            trovate = trovate[dentro]
+        return trovate
+
+    # Funzione per leggere le note (Mese, Canale, Note, posizione della riga) di alcuni indici interni
+    def voci(self, indici):
+        return [
+            {
+                "Mese": self.nomi_mesi[codice_mese] if codice_mese >= 0 else "",
+                "Canale": self.nomi_canali[codice_canale] if codice_canale >= 0 else "",
+                "Note": self.testi[codice_testo],
+                "Posizione": int(posizione),
+            }
+            for codice_mese, codice_canale, codice_testo, posizione in zip(
+                self.codici_mesi[indici], self.codici_canali[indici], self.codici_testi[indici], self.posizioni[indici]
+            )
+        ]
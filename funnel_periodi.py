@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+MESI = [
+    "Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+    "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"
+]
+_NUMERI_MESI = {nome.lower(): numero for numero, nome in enumerate(MESI, start=1)}
+
+# Ordinale usato da pandas per i periodi mancanti (NaT)
+ORDINALE_NAT = np.iinfo(np.int64).min
+
+
+# Funzione per interpretare un mese testuale ("Gennaio 2025"); NaT se non è valido
+def periodo_da_testo(testo):
+    parti = str(testo).split()
+    if len(parti) == 2 and parti[0].lower() in _NUMERI_MESI and parti[1].isdigit():
+        return pd.Period(year=int(parti[1]), month=_NUMERI_MESI[parti[0].lower()], freq="M")
+    return pd.NaT
+
+
+# Funzione per convertire un periodo nel testo usato dalla colonna "Mese"
+def mese_da_periodo(periodo):
+    return f"{MESI[periodo.month - 1]} {periodo.year}"
+
+
+# Funzione per convertire la colonna "Mese" in periodi mensili.
+# Si interpreta una sola volta ogni valore distinto, poi si espande con i codici categoriali.
+def periodo_da_mese(mesi):
+    categorie = mesi.astype("category")
+    ordinali = pd.PeriodIndex(
+        [periodo_da_testo(valore) for valore in categorie.cat.categories], dtype="period[M]"
+    ).asi8
+    # Il codice -1 (valore mancante) punta all'ultimo elemento: NaT
+    ordinali = np.append(ordinali, ORDINALE_NAT)[categorie.cat.codes.to_numpy()]
+    return pd.Series(pd.arrays.PeriodArray(ordinali, dtype="period[M]"), index=mesi.index, name="Periodo")
+
+
+# Funzione per ordinare i mesi testuali in ordine cronologico (quelli non validi in fondo)
+def ordina_mesi(mesi):
+    def chiave(mese):
+        periodo = periodo_da_testo(mese)
+        return (1, 0, str(mese)) if pd.isna(periodo) else (0, periodo.ordinal, str(mese))
+    return sorted(mesi, key=chiave)
+
+
+# Indice ordinato per (Canale, Periodo): per ogni canale le posizioni delle righe
+# ordinate per mese, così un intervallo dal/al si trova con due ricerche binarie
+# invece di una maschera booleana su tutto il dataset.
+class IndicePeriodi:
+    def __init__(self, df):
+        ordinali = df["Periodo"].array.asi8
+        validi = np.flatnonzero(ordinali != ORDINALE_NAT)
+        self.canali = {}
+        # Indice globale (tutti i canali)
+        ordine = validi[np.argsort(ordinali[validi], kind="stable")]
+        self.globale = (ordinali[ordine], ordine)
+        # Un solo lexsort per canale e periodo, poi si divide ai cambi di canale
+        codici = df["Canale"].astype("category").cat
+        codici_validi = codici.codes.to_numpy()[validi]
+        ordine = validi[np.lexsort((ordinali[validi], codici_validi))]
+        codici_ordinati = codici.codes.to_numpy()[ordine]
+        confini = np.flatnonzero(np.diff(codici_ordinati)) + 1
+        for blocco in np.split(ordine, confini):
+            if len(blocco) and codici.codes.iloc[blocco[0]] >= 0:
+                canale = codici.categories[codici.codes.iloc[blocco[0]]]
+                self.canali[canale] = (ordinali[blocco], blocco)
+
+    # Funzione per ottenere le posizioni delle righe tra due periodi (estremi inclusi)
+    def posizioni(self, canali=None, da=None, a=None):
+        if canali is None:
+            blocchi = [self.globale]
+        else:
+            blocchi = [self.canali[canale] for canale in canali if canale in self.canali]
+        risultato = []
+        for ordinali, posizioni in blocchi:
+            inizio = 0 if da is None else np.searchsorted(ordinali, da.ordinal, side="left")
+            fine = len(ordinali) if a is None else np.searchsorted(ordinali, a.ordinal, side="right")
+            risultato.append(posizioni[inizio:fine])
+        return np.concatenate(risultato) if risultato else np.array([], dtype=np.int64)
+
+    # Funzione per elencare i periodi presenti (ordinati) per i canali indicati
+    def periodi(self, canali=None):
+        if canali is None:
+            ordinali = self.globale[0]
+        else:
+            blocchi = [self.canali[canale][0] for canale in canali if canale in self.canali]
+            ordinali = np.concatenate(blocchi) if blocchi else np.array([], dtype=np.int64)
+        return list(pd.PeriodIndex(pd.arrays.PeriodArray(np.unique(ordinali), dtype="period[M]")))
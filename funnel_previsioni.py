@@ -0,0 +1,211 @@
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from funnel_periodi import mese_da_periodo, periodo_da_testo
+from funnel_processi import invia_al_pool
+from funnel_storage import cubo_funnel, versione_dati
+from funnel_tracce import conta
+
+logger = logging.getLogger(__name__)
+
+# Previsioni mensili di Lead, Vendite e Investimento per canale (il CAC si ricava dalle ultime due).
+# I modelli si addestrano in processi separati, fuori dalle rerun della dashboard, e restano
+# in memoria insieme alla firma dei dati del canale: una scrittura riaddestra solo i canali
+# che ha toccato, e la dashboard legge sempre e solo modelli già pronti.
+# Tutti i canali si prevedono dal mese dopo l'ultimo con dati (di qualunque canale), così si
+# possono sommare: i valori si calcolano alla lettura dai parametri del modello.
+# FUNNEL_PREVISIONI_PROCESSI: numero di processi di addestramento (predefinito: uno per CPU, max 4)
+COLONNE_PREVISTE = ["Lead", "Vendite", "Investimento"]
+MESI_PREVISTI = 3
+# Sotto questo numero di mesi con dati il canale non ha previsioni
+MESI_MINIMI = 6
+# Con almeno due anni di storico il modello tiene conto anche della stagionalità
+MESI_STAGIONALITA = 24
+PROCESSI = int(os.environ.get("FUNNEL_PREVISIONI_PROCESSI", "0") or 0) or min(os.cpu_count() or 1, 4)
+
+_lock = threading.Lock()
+# canale -> {"firma", "numero", "modello", "errore", "ultimo", "previsioni"} dell'ultimo addestramento
+# concluso; "previsioni" è la tabella calcolata dal mese dopo "ultimo"
+_modelli = {}
+# canale -> firma in addestramento
+_in_corso = {}
+# Numero progressivo degli addestramenti: un risultato vecchio non sostituisce uno più recente
+_numeri = itertools.count(1)
+_stato = {"pool": None, "versione": None, "serie": {}, "firme": {}, "ultimo": 0}
+
+
+# Funzione per ottenere le serie mensili di ogni canale dal cubo: (ordinali dei mesi, valori),
+# e la firma dei canali con abbastanza mesi per una previsione.
+# Serie e firme si ricalcolano solo quando cambia la versione dei dati.
+def serie_canali():
+    # Prima il cubo: con il backend SQL si aggiorna (e cambia la versione) se un altro processo ha scritto
+    cubo = cubo_funnel()
+    versione = versione_dati()
+    with _lock:
+        if _stato["versione"] == versione:
+            return _stato["serie"], _stato["firme"]
+    colonne = [cubo.indice.index(colonna) for colonna in COLONNE_PREVISTE]
+    serie = {}
+    for canale, prefissi in list(cubo.prefissi_canale.items()):
+        if canale is None or not len(prefissi.ordinali):
+            continue
+        valori = np.diff(prefissi.cumulate, axis=0)
+        # I mesi svuotati da una modifica restano nelle somme con una riga a zero
+        pieni = valori[:, -1] > 0
+        if pieni.any():
+            serie[canale] = (prefissi.ordinali[pieni].copy(), valori[pieni][:, colonne])
+    ultimo = max((ordinali[-1] for ordinali, _ in serie.values()), default=0)
+    firme = {
+        canale: firma_serie(ordinali, valori)
+        for canale, (ordinali, valori) in serie.items() if len(ordinali) >= MESI_MINIMI
+    }
+    with _lock:
+        _stato.update(versione=versione, serie=serie, firme=firme, ultimo=ultimo)
+    return serie, firme
+
+
+# Funzione per calcolare la firma dei dati di un canale: cambia solo se cambia la sua serie
+def firma_serie(ordinali, valori):
+    return hashlib.blake2b(ordinali.tobytes() + valori.tobytes(), digest_size=16).hexdigest()
+
+
+# Funzione per costruire le variabili del modello: andamento (mesi dall'inizio) e, se richiesta,
+# un indicatore per ogni mese dell'anno
+def _variabili(ordinali, primo, stagionalita):
+    andamento = (ordinali - primo).reshape(-1, 1).astype(np.float64)
+    if not stagionalita:
+        return andamento
+    return np.hstack([andamento, np.eye(12)[ordinali % 12]])
+
+
+# Funzione eseguita nei processi di addestramento: adatta il modello alla serie di un canale.
+# Il modello torna come parametri numpy, così la dashboard non importa mai sklearn.
+def addestra(ordinali, valori):
+    from sklearn.linear_model import Ridge
+
+    stagionalita = len(ordinali) >= MESI_STAGIONALITA
+    modello = Ridge(alpha=1.0).fit(_variabili(ordinali, ordinali[0], stagionalita), valori)
+    return {
+        "coefficienti": modello.coef_, "intercetta": modello.intercept_,
+        "primo": int(ordinali[0]), "stagionalita": stagionalita,
+    }
+
+
+# Funzione per prevedere i mesi indicati (ordinali) con i parametri di un modello
+def prevedi(parametri, futuri):
+    variabili = _variabili(futuri, parametri["primo"], parametri["stagionalita"])
+    return np.clip(variabili @ parametri["coefficienti"].T + parametri["intercetta"], 0, None)
+
+
+# Funzione per salvare l'esito di un addestramento concluso (chiamata dal thread del pool)
+def _conclusa(canale, firma, numero, futuro):
+    try:
+        voce = {"modello": futuro.result(), "errore": None}
+    except Exception as errore:
+        logger.warning("Addestramento delle previsioni fallito per %s: %s", canale, errore)
+        voce = {"modello": None, "errore": str(errore)}
+    with _lock:
+        if _in_corso.get(canale) == firma:
+            del _in_corso[canale]
+        if _modelli.get(canale, {}).get("numero", 0) < numero:
+            _modelli[canale] = {"firma": firma, "numero": numero, "ultimo": None, "previsioni": None, **voce}
+
+
+# Funzione per convertire le previsioni in tabella (una riga per mese, CAC compreso)
+def _tabella(futuri, previsti):
+    tabella = pd.DataFrame(previsti, columns=COLONNE_PREVISTE)
+    tabella["CAC"] = tabella["Investimento"] / tabella["Vendite"].where(tabella["Vendite"] > 0)
+    tabella.insert(0, "Mese", [mese_da_periodo(pd.Period(ordinal=ordinale, freq="M")) for ordinale in futuri])
+    return tabella
+
+
+# Funzione per avviare in background l'addestramento dei canali con dati nuovi (senza attendere).
+# Restituisce i canali messi in addestramento; con "attendi" aspetta che finiscano.
+# Non solleva errori: un invio fallito (anche con il pool ricreato) resta come errore del canale.
+def aggiorna_previsioni(attendi=False):
+    inviati = []
+    serie, firme = serie_canali()
+    for canale, firma in firme.items():
+        with _lock:
+            if _modelli.get(canale, {}).get("firma") == firma or _in_corso.get(canale) == firma:
+                continue
+            numero = next(_numeri)
+            try:
+                futuro = invia_al_pool(_stato, PROCESSI, addestra, *serie[canale])
+            except Exception as errore:
+                futuro = concurrent.futures.Future()
+                futuro.set_exception(errore)
+            else:
+                _in_corso[canale] = firma
+        if not attendi:
+            futuro.add_done_callback(
+                lambda futuro, canale=canale, firma=firma, numero=numero: _conclusa(canale, firma, numero, futuro)
+            )
+        inviati.append((canale, firma, numero, futuro))
+    conta("previsioni.addestramenti", len(inviati))
+    # Chi attende salva i risultati da sé: wait() ritorna prima che le callback siano eseguite
+    if attendi:
+        for canale, firma, numero, futuro in inviati:
+            _conclusa(canale, firma, numero, futuro)
+    return [canale for canale, _, _, _ in inviati]
+
+
+# Funzione per leggere le previsioni dei modelli già pronti (None = tutti i canali, sommate).
+# Non addestra nulla: restituisce (tabella o None, canali senza previsioni aggiornate).
+# I canali con meno di MESI_MINIMI mesi di dati sono esclusi.
+def leggi_previsioni(canali=None):
+    _, firme = serie_canali()
+    canali = list(firme) if canali is None else [canale for canale in canali if canale in firme]
+    tabelle, mancanti = [], []
+    with _lock:
+        ultimo = _stato["ultimo"]
+        for canale in canali:
+            voce = _modelli.get(canale)
+            if voce is None or voce["modello"] is None:
+                mancanti.append(canale)
+                continue
+            # Una previsione di dati ormai cambiati si mostra finché non arriva quella nuova
+            if voce["firma"] != firme[canale]:
+                mancanti.append(canale)
+            # La tabella si ricalcola solo quando si sposta l'ultimo mese con dati
+            if voce["ultimo"] != ultimo:
+                futuri = np.arange(ultimo + 1, ultimo + 1 + MESI_PREVISTI)
+                voce.update(ultimo=ultimo, previsioni=_tabella(futuri, prevedi(voce["modello"], futuri)))
+            tabelle.append(voce["previsioni"])
+    conta("previsioni.lette", len(tabelle))
+    if not tabelle:
+        return None, mancanti
+    if len(tabelle) == 1:
+        return tabelle[0], mancanti
+    # Più canali: si sommano mese per mese e il CAC si ricalcola sui totali
+    somma = pd.concat(tabelle).groupby("Mese", sort=False)[COLONNE_PREVISTE].sum().reset_index()
+    somma = somma.sort_values("Mese", key=lambda mesi: mesi.map(periodo_da_testo), ignore_index=True)
+    somma["CAC"] = somma["Investimento"] / somma["Vendite"].where(somma["Vendite"] > 0)
+    return somma, mancanti
+
+
+# Funzione per sapere se qualche canale è in addestramento
+def addestramento_in_corso():
+    with _lock:
+        return bool(_in_corso)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Addestra i modelli di previsione e mostra i mesi successivi")
+    parser.add_argument("--canale", action="append", help="Mostra solo questo canale (ripetibile)")
+    argomenti = parser.parse_args()
+
+    addestrati = aggiorna_previsioni(attendi=True)
+    print(f"Canali addestrati: {', '.join(addestrati) or 'nessuno'}")
+    for canale in argomenti.canale or list(serie_canali()[0]):
+        tabella, _ = leggi_previsioni([canale])
+        print(f"\n{canale}")
+        print(tabella.to_string(index=False) if tabella is not None else f"  meno di {MESI_MINIMI} mesi di dati")
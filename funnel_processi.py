@@ -0,0 +1,51 @@
+import concurrent.futures
+import multiprocessing
+import sys
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+# Pool di processi per i lavori pesanti avviati dalla dashboard (previsioni, report).
+# I processi partono con "spawn": non ereditano i thread e i lock del server Streamlit.
+
+# Lock dello scambio di __main__ in invia: un solo thread alla volta lo sostituisce
+_lock = threading.Lock()
+
+
+# Funzione per creare un pool di processi "spawn"
+def crea_pool(processi):
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context("spawn"))
+
+
+# Funzione per inviare un lavoro al pool. I processi "spawn" rieseguono il file del modulo
+# __main__, che sotto Streamlit è lo script della dashboard, qualunque sia il modulo della
+# funzione: il pool avvia i processi dentro submit, e intanto __main__ è questo modulo, senza
+# effetti all'importazione. Le funzioni dello script lanciato da riga di comando (modulo __main__)
+# hanno bisogno del loro modulo e lo tengono.
+def invia(pool, funzione, *argomenti):
+    if funzione.__module__ == "__main__":
+        return pool.submit(funzione, *argomenti)
+    with _lock:
+        principale = sys.modules.get("__main__")
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            return pool.submit(funzione, *argomenti)
+        finally:
+            # Se nel frattempo Streamlit ha avviato un altro script, resta il suo
+            if sys.modules.get("__main__") is sys.modules[__name__]:
+                sys.modules["__main__"] = principale
+
+
+# Funzione per inviare un lavoro al pool tenuto in stato["pool"] (creato alla prima richiesta).
+# Un pool rotto (un processo terminato all'improvviso) non accetta più lavori: si chiude,
+# se ne crea uno nuovo e il lavoro si invia di nuovo. Va chiamata sotto il lock di chi possiede lo stato.
+def invia_al_pool(stato, processi, funzione, *argomenti):
+    for tentativo in range(2):
+        if stato["pool"] is None:
+            stato["pool"] = crea_pool(processi)
+        try:
+            return invia(stato["pool"], funzione, *argomenti)
+        except BrokenProcessPool:
+            stato["pool"].shutdown(wait=False, cancel_futures=True)
+            stato["pool"] = None
+            if tentativo:
+                raise
@@ -0,0 +1,384 @@
+import argparse
+import atexit
+import concurrent.futures
+import contextlib
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import textwrap
+import threading
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from funnel_grafici import COLORI_FASI, formatta_metrica
+from funnel_import import CANALI
+from funnel_metriche import FASI_FUNNEL, NOMI_CONVERSIONI, calcola_metriche
+from funnel_periodi import mese_da_periodo, periodo_da_testo
+from funnel_processi import invia_al_pool
+from funnel_storage import cerca_note, periodi_disponibili, totali_intervallo
+
+logger = logging.getLogger(__name__)
+
+# Report per canale (più un riepilogo "Globale") di un periodo, o di ogni mese del periodo:
+# card delle metriche, grafico a imbuto come immagine e note. I dati si leggono nel processo
+# della dashboard (totali e note sono già in cache); i documenti si creano in un pool di
+# processi, uno per core, e finiscono in uno zip man mano che sono pronti.
+# Il grafico si esporta con kaleido se installato, altrimenti si disegna con matplotlib.
+# Esempio: python funnel_report.py --da "Gennaio 2025" --a "Dicembre 2025" --mensili --output report.zip
+# FUNNEL_REPORT_PROCESSI: numero di processi (predefinito: uno per CPU)
+FORMATI = ["docx", "pdf"]
+GLOBALE = "Globale"
+PROCESSI = int(os.environ.get("FUNNEL_REPORT_PROCESSI", "0") or 0) or (os.cpu_count() or 1)
+# Note riportate in ogni documento (le altre si contano soltanto)
+NOTE_MAX = 200
+# Dimensioni del grafico esportato (pixel)
+LARGHEZZA_GRAFICO = 900
+ALTEZZA_GRAFICO = 500
+RIGHE_NOTE_PER_PAGINA = 50
+# Zip dei lavori avviati dalla dashboard: un lavoro concluso resta scaricabile per DURATA_LAVORI
+# secondi e ne restano al massimo LAVORI_MASSIMI (i più vecchi si eliminano prima)
+CARTELLA_ZIP = os.path.join(tempfile.gettempdir(), "funnel_report")
+DURATA_LAVORI = 3600
+LAVORI_MASSIMI = 20
+
+_lock = threading.Lock()
+# Lavori avviati dalla dashboard: id -> stato (totale, fatti, errori, zip, finito, concluso)
+_lavori = {}
+_stato = {"pool": None, "cartella_pulita": False}
+
+
+# Funzione per descrivere un periodo (estremi inclusi, None = senza limite)
+def descrivi_periodo(da, a):
+    if da is None and a is None:
+        return "Tutto lo storico"
+    if da is not None and da == a:
+        return mese_da_periodo(da)
+    return f"{mese_da_periodo(da) if da is not None else 'Inizio'} - {mese_da_periodo(a) if a is not None else 'oggi'}"
+
+
+# Funzione per preparare i dati di tutti i report richiesti (un dizionario per documento).
+# Con "mensili" si crea un report per ogni mese tra da e a; i canali senza dati si saltano.
+def elenca_report(da=None, a=None, mensili=False, formato="docx"):
+    if mensili:
+        periodi = periodi_disponibili()
+        if not periodi:
+            return []
+        inizio = periodi[0] if da is None else da
+        fine = periodi[-1] if a is None else a
+        intervalli = [(periodo, periodo) for periodo in pd.period_range(inizio, fine, freq="M")]
+    else:
+        intervalli = [(da, a)]
+    reports = []
+    for inizio, fine in intervalli:
+        descrizione = descrivi_periodo(inizio, fine)
+        for canale in CANALI + [GLOBALE]:
+            canali = None if canale == GLOBALE else [canale]
+            totali = totali_intervallo(canali, inizio, fine)
+            if totali["Righe"] == 0:
+                continue
+            voci, totale_note, _ = cerca_note(canali, da=inizio, a=fine, per_pagina=NOTE_MAX)
+            reports.append({
+                "canale": canale,
+                "periodo": descrizione,
+                "totali": totali.to_dict(),
+                "metriche": calcola_metriche(totali),
+                "note": [
+                    f"{voce['Mese']}{' · ' + voce['Canale'] if canali is None else ''}: {voce['Note']}" for voce in voci
+                ],
+                "note_escluse": totale_note - len(voci),
+                "formato": formato,
+                "nome_file": f"{descrizione}/{canale}.{formato}" if mensili else f"{canale}.{formato}",
+            })
+    return reports
+
+
+# Funzione per ottenere le righe della tabella delle metriche (nome, valore formattato)
+def righe_metriche(metriche):
+    righe = [(nome, formatta_metrica(nome, valore)) for nome, valore in metriche.items() if not isinstance(valore, list)]
+    righe += [
+        (nome, formatta_metrica(nome, tasso)) for nome, tasso in zip(NOMI_CONVERSIONI, metriche["Tassi Conversione"])
+    ]
+    return righe
+
+
+# Funzione per disegnare il grafico a imbuto con matplotlib (stessi colori e tassi del grafico plotly)
+def _funnel_matplotlib(totali, titolo, tassi):
+    from matplotlib.figure import Figure
+
+    sfondo = "#2C2C2C"
+    valori = np.array([float(totali[fase]) for fase in FASI_FUNNEL])
+    posizioni = np.arange(len(FASI_FUNNEL))[::-1]
+    figura = Figure(figsize=(LARGHEZZA_GRAFICO / 100, ALTEZZA_GRAFICO / 100), dpi=100, facecolor=sfondo)
+    asse = figura.subplots()
+    asse.barh(posizioni, valori, left=-valori / 2, color=COLORI_FASI, height=0.8)
+    meta = max(valori.max() / 2, 1)
+    for posizione, valore, tasso in zip(posizioni, valori, tassi):
+        iniziale = f" ({valore / valori[0]:.0%})" if valori[0] > 0 else ""
+        asse.text(0, posizione, f"{valore:,.0f}{iniziale}", ha="center", va="center", color="white", fontsize=11)
+        asse.text(valore / 2 + meta * 0.03, posizione, f"{tasso:.2f}%" if tasso is not None else "N/A",
+                  ha="left", va="center", color="white", fontsize=11)
+    asse.set_xlim(-meta * 1.05, meta * 1.35)
+    asse.set_yticks(posizioni, FASI_FUNNEL, color="white")
+    asse.set_xticks([])
+    asse.set_facecolor(sfondo)
+    for bordo in asse.spines.values():
+        bordo.set_visible(False)
+    asse.set_title(titolo, color="white", loc="left")
+    figura.tight_layout()
+    immagine = io.BytesIO()
+    figura.savefig(immagine, format="png", facecolor=sfondo)
+    return immagine.getvalue()
+
+
+# Funzione per esportare il grafico a imbuto di un report come PNG
+def immagine_funnel(report):
+    titolo = f"Funnel per {report['canale']}"
+    tassi = report["metriche"]["Tassi Conversione"]
+    if importlib.util.find_spec("kaleido") is not None:
+        from funnel_grafici import crea_grafico_funnel
+
+        figura = crea_grafico_funnel(pd.Series(report["totali"]), titolo, tassi)
+        return figura.to_image(format="png", width=LARGHEZZA_GRAFICO, height=ALTEZZA_GRAFICO)
+    return _funnel_matplotlib(report["totali"], titolo, tassi)
+
+
+# Funzione per creare un documento Word
+def _docx(report, grafico):
+    from docx import Document
+    from docx.shared import Inches
+
+    documento = Document()
+    documento.add_heading(f"Report {report['canale']}", level=0)
+    documento.add_paragraph(report["periodo"])
+    documento.add_heading("Metriche", level=1)
+    tabella = documento.add_table(rows=0, cols=2)
+    tabella.style = "Table Grid"
+    for nome, valore in righe_metriche(report["metriche"]):
+        celle = tabella.add_row().cells
+        celle[0].text, celle[1].text = nome, valore
+    documento.add_heading("Grafico Funnel", level=1)
+    documento.add_picture(io.BytesIO(grafico), width=Inches(6.3))
+    documento.add_heading("Note", level=1)
+    for nota in report["note"]:
+        documento.add_paragraph(nota, style="List Bullet")
+    if not report["note"]:
+        documento.add_paragraph("Nessuna nota.")
+    if report["note_escluse"]:
+        documento.add_paragraph(f"... e altre {report['note_escluse']} note.")
+    contenuto = io.BytesIO()
+    documento.save(contenuto)
+    return contenuto.getvalue()
+
+
+# Funzione per creare un PDF (A4) con matplotlib: metriche e grafico, poi le note
+def _pdf(report, grafico):
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+    from matplotlib.image import imread
+
+    contenuto = io.BytesIO()
+    with PdfPages(contenuto) as pdf:
+        pagina = Figure(figsize=(8.27, 11.69))
+        pagina.text(0.08, 0.95, f"Report {report['canale']}", fontsize=20, weight="bold")
+        pagina.text(0.08, 0.925, report["periodo"], fontsize=12)
+        asse = pagina.add_axes([0.08, 0.5, 0.84, 0.4])
+        asse.axis("off")
+        asse.table(cellText=righe_metriche(report["metriche"]), colLabels=["Metrica", "Valore"],
+                   colWidths=[0.7, 0.3], loc="upper center")
+        asse = pagina.add_axes([0.08, 0.05, 0.84, 0.42])
+        # Immagine incorporata così com'è, senza ricampionarla
+        asse.imshow(imread(io.BytesIO(grafico), format="png"), interpolation="none")
+        asse.axis("off")
+        pdf.savefig(pagina)
+
+        righe = [riga for nota in report["note"] for riga in textwrap.wrap(f"• {nota}", 95)] or ["Nessuna nota."]
+        if report["note_escluse"]:
+            righe.append(f"... e altre {report['note_escluse']} note.")
+        for inizio in range(0, len(righe), RIGHE_NOTE_PER_PAGINA):
+            pagina = Figure(figsize=(8.27, 11.69))
+            pagina.text(0.08, 0.95, "Note", fontsize=16, weight="bold")
+            for numero, riga in enumerate(righe[inizio:inizio + RIGHE_NOTE_PER_PAGINA]):
+                pagina.text(0.08, 0.91 - numero * 0.017, riga, fontsize=9)
+            pdf.savefig(pagina)
+    return contenuto.getvalue()
+
+
+# Funzione eseguita nei processi del pool: crea un documento e restituisce (nome nello zip, contenuto).
+# python-docx e matplotlib si importano solo qui.
+def crea_documento(report):
+    grafico = immagine_funnel(report)
+    crea = _pdf if report["formato"] == "pdf" else _docx
+    return report["nome_file"], crea(report, grafico)
+
+
+# Funzione per inviare la creazione di un documento al pool condiviso dai lavori
+# (creato alla prima richiesta, ricreato se un processo è terminato all'improvviso)
+def _invia(report):
+    with _lock:
+        return invia_al_pool(_stato, PROCESSI, crea_documento, report)
+
+
+# Funzione per creare i documenti in parallelo e scriverli nello zip (percorso o file) appena pronti.
+# "avanzamento" riceve (fatti, totale, nome) dopo ogni documento. Restituisce gli errori.
+def genera_report(reports, destinazione, avanzamento=None):
+    errori = []
+    with zipfile.ZipFile(destinazione, "w", compression=zipfile.ZIP_DEFLATED) as archivio:
+        futuri = {_invia(report): report for report in reports}
+        for fatti, futuro in enumerate(concurrent.futures.as_completed(futuri), start=1):
+            report = futuri[futuro]
+            try:
+                nome, contenuto = futuro.result()
+                archivio.writestr(nome, contenuto)
+            except Exception as errore:
+                logger.warning("Report %s non creato: %s", report["nome_file"], errore)
+                errori.append(f"{report['nome_file']}: {errore}")
+            if avanzamento is not None:
+                avanzamento(fatti, len(futuri), report["nome_file"])
+    return errori
+
+
+# Funzione eseguita nel thread di un lavoro: prepara i dati e crea lo zip
+def _esegui(lavoro, da, a, mensili, formato):
+    stato = _lavori[lavoro]
+
+    def avanzamento(fatti, totale, nome):
+        with _lock:
+            stato.update(fatti=fatti, ultimo=nome)
+
+    # Senza nessun documento (lavoro fallito, anche per il pool rotto e ricreato) lo zip non serve
+    vuoto = True
+    try:
+        reports = elenca_report(da, a, mensili, formato)
+        with _lock:
+            stato["totale"] = len(reports)
+        errori = genera_report(reports, stato["percorso"], avanzamento)
+        vuoto = len(errori) >= len(reports)
+        with _lock:
+            stato["errori"] = errori
+    except Exception as errore:
+        logger.exception("Generazione dei report fallita")
+        with _lock:
+            stato["errori"] = [str(errore)]
+    finally:
+        with _lock:
+            percorso = stato["percorso"]
+            stato.update(finito=True, secondi=time.perf_counter() - stato["inizio"], concluso=time.time())
+            if vuoto:
+                stato["percorso"] = None
+        if vuoto:
+            _rimuovi([percorso])
+
+
+# Funzione per eliminare dei file di zip (quelli già eliminati si ignorano)
+def _rimuovi(percorsi):
+    for percorso in percorsi:
+        if percorso is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(percorso)
+
+
+# Funzione per togliere i lavori conclusi da più di DURATA_LAVORI secondi e, oltre LAVORI_MASSIMI,
+# i più vecchi. Va chiamata sotto _lock; restituisce i loro zip da eliminare (fuori dal lock).
+def _scaduti():
+    adesso = time.time()
+    conclusi = sorted((stato["concluso"], lavoro) for lavoro, stato in _lavori.items() if stato["finito"])
+    scaduti = {lavoro for concluso, lavoro in conclusi if adesso - concluso > DURATA_LAVORI}
+    scaduti.update(lavoro for _, lavoro in conclusi[:max(len(conclusi) - LAVORI_MASSIMI, 0)])
+    return [_lavori.pop(lavoro)["percorso"] for lavoro in scaduti]
+
+
+# Funzione per eliminare gli zip rimasti da processi terminati senza chiudere
+# (più vecchi di DURATA_LAVORI: quelli dei lavori in corso si aggiornano di continuo)
+def _pulisci_cartella():
+    adesso = time.time()
+    for voce in os.scandir(CARTELLA_ZIP):
+        with contextlib.suppress(FileNotFoundError):
+            if voce.name.startswith("funnel_report_") and adesso - voce.stat().st_mtime > DURATA_LAVORI:
+                os.remove(voce.path)
+
+
+# Funzione eseguita all'uscita del processo: chiude il pool ed elimina gli zip di tutti i lavori
+def _chiudi():
+    with _lock:
+        pool, _stato["pool"] = _stato["pool"], None
+        percorsi = [stato["percorso"] for stato in _lavori.values()]
+        _lavori.clear()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    _rimuovi(percorsi)
+
+
+atexit.register(_chiudi)
+
+
+# Funzione per avviare la generazione in background (la dashboard resta libera); restituisce l'id
+def avvia_report(da=None, a=None, mensili=False, formato="docx"):
+    os.makedirs(CARTELLA_ZIP, exist_ok=True)
+    with _lock:
+        pulire, _stato["cartella_pulita"] = not _stato["cartella_pulita"], True
+    if pulire:
+        _pulisci_cartella()
+    descrittore, percorso = tempfile.mkstemp(prefix="funnel_report_", suffix=".zip", dir=CARTELLA_ZIP)
+    os.close(descrittore)
+    lavoro = os.urandom(8).hex()
+    with _lock:
+        scaduti = _scaduti()
+        _lavori[lavoro] = {
+            "totale": None, "fatti": 0, "ultimo": None, "errori": [], "finito": False,
+            "percorso": percorso, "inizio": time.perf_counter(), "secondi": None, "concluso": None,
+            "nome": f"report {descrivi_periodo(da, a)}.zip",
+        }
+    _rimuovi(scaduti)
+    threading.Thread(target=_esegui, args=(lavoro, da, a, mensili, formato), name=f"report-{lavoro}", daemon=True).start()
+    return lavoro
+
+
+# Funzione per leggere lo stato di un lavoro (una copia; None se sconosciuto o scaduto).
+# Il percorso dello zip è None se non c'è nessun documento da scaricare.
+def stato_report(lavoro):
+    with _lock:
+        scaduti = _scaduti()
+        stato = _lavori.get(lavoro)
+        stato = dict(stato) if stato is not None else None
+    _rimuovi(scaduti)
+    return stato
+
+
+# Funzione per dimenticare un lavoro concluso ed eliminare il suo zip
+def elimina_report(lavoro):
+    with _lock:
+        stato = _lavori.get(lavoro)
+        if stato is None or not stato["finito"]:
+            return False
+        del _lavori[lavoro]
+    _rimuovi([stato["percorso"]])
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea i report di canali e Globale in uno zip")
+    parser.add_argument("--da", help="Primo mese (es. \"Gennaio 2025\"); predefinito: tutto lo storico")
+    parser.add_argument("--a", help="Ultimo mese (es. \"Dicembre 2025\")")
+    parser.add_argument("--mensili", action="store_true", help="Un report per ogni mese del periodo")
+    parser.add_argument("--formato", choices=FORMATI, default="docx")
+    parser.add_argument("--output", default="report.zip", help="Zip di destinazione")
+    argomenti = parser.parse_args()
+
+    inizio = time.perf_counter()
+    da = periodo_da_testo(argomenti.da) if argomenti.da else None
+    a = periodo_da_testo(argomenti.a) if argomenti.a else None
+    if (argomenti.da and pd.isna(da)) or (argomenti.a and pd.isna(a)):
+        parser.error("mese non valido: usare il formato \"Gennaio 2025\"")
+    reports = elenca_report(da, a, argomenti.mensili, argomenti.formato)
+    errori = genera_report(
+        reports, argomenti.output,
+        lambda fatti, totale, nome: print(f"[{fatti}/{totale}] {nome}", flush=True),
+    )
+    for errore in errori:
+        print(f"Errore: {errore}")
+    print(f"{len(reports) - len(errori)} report in {argomenti.output} ({time.perf_counter() - inizio:.1f}s, {PROCESSI} processi)")
@@ -0,0 +1,175 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+# Tracce delle rerun della dashboard: intervalli temporizzati (annidati) e contatori
+# (righe lette, byte letti, hit e miss delle cache). Le tracce campionate vengono
+# scritte come righe JSON, una per intervallo, con i campi degli span OpenTelemetry.
+# FUNNEL_TRACCE_CAMPIONE: frazione di rerun tracciate (0 = spento, 1 = tutte)
+# FUNNEL_TRACCE_FILE: file JSON lines di destinazione
+CAMPIONE_TRACCE = float(os.environ.get("FUNNEL_TRACCE_CAMPIONE", "0") or 0)
+FILE_TRACCE = os.environ.get("FUNNEL_TRACCE_FILE", "funnel_tracce.jsonl")
+SERVIZIO = "funnel-dashboard"
+
+# Traccia attiva nel thread (ogni sessione Streamlit esegue le rerun nel proprio thread)
+_traccia_corrente = contextvars.ContextVar("traccia_funnel", default=None)
+_lock_file = threading.Lock()
+# Senza traccia attiva un intervallo non fa nulla: si riusa sempre lo stesso contesto vuoto
+_NESSUNO = contextlib.nullcontext()
+
+
+class Traccia:
+    def __init__(self, nome, attributi):
+        self.id = os.urandom(16).hex()
+        self.intervalli = []
+        self.contatori = {}
+        self._aperti = []
+        self.radice = self._apri(nome, attributi)
+
+    def _apri(self, nome, attributi):
+        intervallo = {
+            "nome": nome,
+            "id": os.urandom(8).hex(),
+            "padre": self._aperti[-1]["id"] if self._aperti else None,
+            "profondita": len(self._aperti),
+            "inizio": time.time_ns(),
+            "fine": None,
+            "attributi": dict(attributi),
+            "contatori": {},
+        }
+        self._aperti.append(intervallo)
+        self.intervalli.append(intervallo)
+        return intervallo
+
+    def _chiudi(self, intervallo):
+        intervallo["fine"] = time.time_ns()
+        # Si chiudono anche gli intervalli figli rimasti aperti (es. dopo un'eccezione)
+        while self._aperti:
+            aperto = self._aperti.pop()
+            if aperto["fine"] is None:
+                aperto["fine"] = intervallo["fine"]
+            if aperto is intervallo:
+                break
+
+    # Funzione per misurare un blocco di codice come intervallo figlio di quello aperto
+    @contextlib.contextmanager
+    def intervallo(self, nome, attributi):
+        intervallo = self._apri(nome, attributi)
+        try:
+            yield intervallo
+        finally:
+            self._chiudi(intervallo)
+
+    # Funzione per incrementare un contatore (sull'intervallo aperto e sul totale della traccia)
+    def conta(self, nome, quantita):
+        self.contatori[nome] = self.contatori.get(nome, 0) + quantita
+        contatori = self._aperti[-1]["contatori"] if self._aperti else self.radice["contatori"]
+        contatori[nome] = contatori.get(nome, 0) + quantita
+
+    # Durata di un intervallo in millisecondi
+    @staticmethod
+    def millisecondi(intervallo):
+        fine = intervallo["fine"] if intervallo["fine"] is not None else time.time_ns()
+        return (fine - intervallo["inizio"]) / 1_000_000
+
+
+# Funzione per iniziare la traccia di una rerun: campionata con probabilità CAMPIONE_TRACCE,
+# oppure sempre con "forza" (pannello di debug). Restituisce la traccia o None.
+# Una traccia rimasta aperta (rerun interrotta da st.rerun o st.stop) viene chiusa ed esportata.
+def inizia_traccia(nome, forza=False, **attributi):
+    if _traccia_corrente.get() is not None:
+        chiudi_traccia(interrotta=True)
+    if not forza and (CAMPIONE_TRACCE <= 0 or random.random() >= CAMPIONE_TRACCE):
+        return None
+    traccia = Traccia(nome, attributi)
+    _traccia_corrente.set(traccia)
+    return traccia
+
+
+# Funzione per chiudere la traccia attiva ed esportarla; restituisce la traccia (o None)
+def chiudi_traccia(interrotta=False):
+    traccia = _traccia_corrente.get()
+    if traccia is None:
+        return None
+    _traccia_corrente.set(None)
+    if interrotta:
+        traccia.radice["attributi"]["interrotta"] = True
+    traccia._chiudi(traccia.radice)
+    esporta_traccia(traccia)
+    return traccia
+
+
+# Funzione per sapere se la rerun corrente è tracciata (per saltare le misure costose)
+def traccia_attiva():
+    return _traccia_corrente.get() is not None
+
+
+# Funzione per aggiungere un attributo all'intervallo radice della traccia attiva
+def imposta_attributo(nome, valore):
+    traccia = _traccia_corrente.get()
+    if traccia is not None:
+        traccia.radice["attributi"][nome] = valore
+
+
+# Funzione per misurare un blocco: "with intervallo('grafico'):"
+def intervallo(nome, **attributi):
+    traccia = _traccia_corrente.get()
+    if traccia is None:
+        return _NESSUNO
+    return traccia.intervallo(nome, attributi)
+
+
+# Funzione per incrementare un contatore della traccia attiva
+def conta(nome, quantita=1):
+    traccia = _traccia_corrente.get()
+    if traccia is not None:
+        traccia.conta(nome, quantita)
+
+
+# Decoratore per misurare ogni chiamata di una funzione come intervallo
+def misurata(nome):
+    def decoratore(funzione):
+        @functools.wraps(funzione)
+        def avvolta(*args, **kwargs):
+            traccia = _traccia_corrente.get()
+            if traccia is None:
+                return funzione(*args, **kwargs)
+            with traccia.intervallo(nome, {}):
+                return funzione(*args, **kwargs)
+        return avvolta
+    return decoratore
+
+
+# Funzione per convertire un intervallo nel formato JSON degli span OpenTelemetry
+def _span(traccia, intervallo):
+    attributi = {f"funnel.{nome}": valore for nome, valore in intervallo["attributi"].items()}
+    attributi.update({f"funnel.contatore.{nome}": valore for nome, valore in intervallo["contatori"].items()})
+    return {
+        "traceId": traccia.id,
+        "spanId": intervallo["id"],
+        "parentSpanId": intervallo["padre"] or "",
+        "name": intervallo["nome"],
+        "kind": "SPAN_KIND_INTERNAL",
+        "startTimeUnixNano": intervallo["inizio"],
+        "endTimeUnixNano": intervallo["fine"],
+        "attributes": attributi,
+        "resource": {"service.name": SERVIZIO},
+    }
+
+
+# Funzione per accodare gli intervalli di una traccia al file (una riga JSON per intervallo)
+def esporta_traccia(traccia, percorso=None):
+    percorso = percorso or FILE_TRACCE
+    if not percorso:
+        return
+    righe = "".join(
+        json.dumps(_span(traccia, intervallo), ensure_ascii=False, default=str) + "\n"
+        for intervallo in traccia.intervalli
+    )
+    with _lock_file, open(percorso, "a", encoding="utf-8") as file:
+        file.write(righe)